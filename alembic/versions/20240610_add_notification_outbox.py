@@ -0,0 +1,47 @@
+"""add notification outbox table"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "20240610_add_outbox"
+down_revision = "20240609_add_email"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "notification_outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "notification_id",
+            sa.Integer,
+            sa.ForeignKey("notifications.id"),
+            nullable=True,
+        ),
+        sa.Column("channel", sa.String, nullable=True),
+        sa.Column("recipient", sa.String, nullable=True),
+        sa.Column("message", sa.String, nullable=True),
+        sa.Column("status", sa.String, nullable=True),
+        sa.Column("attempts", sa.Integer, nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime, nullable=True),
+        sa.Column("last_error", sa.String, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=True),
+        sa.Column("sent_at", sa.DateTime, nullable=True),
+    )
+    op.create_index(
+        "ix_notification_outbox_id", "notification_outbox", ["id"], unique=False
+    )
+    op.create_index(
+        "ix_notification_outbox_status_next",
+        "notification_outbox",
+        ["status", "next_attempt_at"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_notification_outbox_status_next", table_name="notification_outbox"
+    )
+    op.drop_index("ix_notification_outbox_id", table_name="notification_outbox")
+    op.drop_table("notification_outbox")
@@ -0,0 +1,20 @@
+"""add token_version column to users"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "20240611_add_token_version"
+down_revision = "20240610_add_outbox"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "users",
+        sa.Column("token_version", sa.Integer(), nullable=True, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_column("users", "token_version")
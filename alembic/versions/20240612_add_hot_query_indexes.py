@@ -0,0 +1,27 @@
+"""index hot query predicates"""
+
+from alembic import op
+
+revision = "20240612_hot_query_indexes"
+down_revision = "20240611_add_token_version"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_items_tenant_name", "items", ["tenant_id", "name"]),
+    ("ix_users_tenant_id", "users", ["tenant_id"]),
+    ("ix_audit_logs_item_timestamp", "audit_logs", ["item_id", "timestamp"]),
+    ("ix_notifications_item_id", "notifications", ["item_id"]),
+    ("ix_categories_department_id", "categories", ["department_id"]),
+    ("ix_password_reset_tokens_expires_at", "password_reset_tokens", ["expires_at"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
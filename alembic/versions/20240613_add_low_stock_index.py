@@ -0,0 +1,25 @@
+"""partial index for the low stock check"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "20240613_low_stock_index"
+down_revision = "20240612_hot_query_indexes"
+branch_labels = None
+depends_on = None
+
+BELOW_THRESHOLD = sa.text("available < threshold")
+
+
+def upgrade():
+    op.create_index(
+        "ix_items_below_threshold",
+        "items",
+        ["tenant_id"],
+        sqlite_where=BELOW_THRESHOLD,
+        postgresql_where=BELOW_THRESHOLD,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_items_below_threshold", table_name="items")
@@ -1,5 +1,11 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import threading
+import time
 
 from config import settings
 
@@ -11,24 +17,128 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from database_async import get_async_db
+from event_bus import publish_auth_invalidation
 from models import User
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = settings.secret_key
 if not SECRET_KEY:
     raise RuntimeError("SECRET_KEY environment variable not set")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+PRINCIPAL_CACHE_TTL = settings.principal_cache_ttl
+PRINCIPAL_CACHE_MAX_SIZE = 10000
+TOKEN_VERSION_CACHE_TTL = settings.token_version_cache_ttl
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+class PasswordHasherBusy(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+class PasswordHasher:
+    """Run bcrypt on a small dedicated thread pool.
+
+    bcrypt releases the GIL, so threads give real parallelism without
+    blocking the event loop. At most ``max_pending`` operations may be queued
+    or running; beyond that callers get ``PasswordHasherBusy`` (503) instead
+    of piling up behind a login storm.
+    """
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+
+    @property
+    def queued(self) -> int:
+        return self.pending - self.in_flight
+
+    def submit(self, func: Callable, *args) -> Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self.pending += 1
+        try:
+            return self._executor.submit(self._run, func, *args)
+        except BaseException:
+            self._done()
+            raise
+
+    def map(self, func: Callable, items: Iterable) -> List:
+        """Apply ``func`` to every item, at most ``workers`` at a time."""
+        items = list(items)
+        results: List = []
+        for start in range(0, len(items), self.workers):
+            futures = [
+                self.submit(func, item) for item in items[start : start + self.workers]
+            ]
+            results.extend(future.result() for future in futures)
+        return results
+
+    def _run(self, func: Callable, *args):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._done()
+
+    def _done(self) -> None:
+        with self._lock:
+            self.pending -= 1
+
+
+password_hasher = PasswordHasher(
+    settings.password_hash_workers, settings.password_hash_max_pending
+)
+metrics.gauge(
+    "password_hash_queue_depth",
+    "Password hash/verify operations waiting for a worker",
+    callback=lambda: password_hasher.queued,
+)
+metrics.gauge(
+    "password_hash_in_flight",
+    "Password hash/verify operations currently running",
+    callback=lambda: password_hasher.in_flight,
+)
+
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.submit(
+        pwd_context.verify, plain_password, hashed_password
+    ).result()
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_hasher.submit(pwd_context.hash, password).result()
+
+
+def get_password_hashes(passwords: Iterable[str]) -> List[str]:
+    return password_hasher.map(pwd_context.hash, passwords)
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await asyncio.wrap_future(
+        password_hasher.submit(pwd_context.verify, plain_password, hashed_password)
+    )
 
 
 async def authenticate_user(
@@ -38,11 +148,157 @@ async def authenticate_user(
         select(User).where((User.username == username) | (User.email == username))
     )
     user = result.scalars().first()
-    if user and verify_password(password, user.hashed_password):
+    if user and await verify_password_async(password, user.hashed_password):
         return user
     return None
 
 
+# Recently resolved users keyed by token subject: (expires_at, snapshot)
+_principal_cache: Dict[str, Tuple[float, User]] = {}
+# Current token_version per user id for stateless tokens: (expires_at, version)
+_version_cache: Dict[int, Tuple[float, Optional[int]]] = {}
+
+
+def _snapshot(user: User) -> User:
+    """Detached copy of the fields authorization needs, safe to share."""
+    return User(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        role=user.role,
+        tenant_id=user.tenant_id,
+        notification_preference=user.notification_preference,
+    )
+
+
+def invalidate_principal(*usernames: Optional[str]) -> None:
+    """Drop cached principals after a user is changed or deleted.
+
+    Other API workers drop theirs through the event bus; if the broker is
+    unreachable they keep them for at most ``PRINCIPAL_CACHE_TTL``.
+    """
+    names = [username for username in usernames if username]
+    for username in names:
+        _principal_cache.pop(username, None)
+    if names:
+        publish_auth_invalidation({"usernames": names})
+
+
+def apply_auth_invalidation(message: str) -> None:
+    """Apply an invalidation published by another worker."""
+    try:
+        data = json.loads(message)
+        usernames = [str(u) for u in data.get("usernames", ())]
+        user_ids = [int(i) for i in data.get("user_ids", ())]
+    except (ValueError, TypeError, AttributeError):
+        logger.warning("Ignoring malformed auth invalidation %r", message)
+        return
+    for username in usernames:
+        _principal_cache.pop(username, None)
+    for user_id in user_ids:
+        _version_cache.pop(user_id, None)
+
+
+def clear_principal_cache() -> None:
+    _principal_cache.clear()
+    _version_cache.clear()
+
+
+async def resolve_principal(db: AsyncSession, username: str) -> Optional[User]:
+    """Return the user for a token subject, served from a short TTL cache."""
+    now = time.monotonic()
+    cached = _principal_cache.get(username)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
+    if user is None:
+        _principal_cache.pop(username, None)
+        return None
+    snapshot = _snapshot(user)
+    if PRINCIPAL_CACHE_TTL > 0:
+        if len(_principal_cache) >= PRINCIPAL_CACHE_MAX_SIZE:
+            _principal_cache.pop(next(iter(_principal_cache)), None)
+        _principal_cache[username] = (now + PRINCIPAL_CACHE_TTL, snapshot)
+    return snapshot
+
+
+def bump_token_version(user: User) -> None:
+    """Revoke stateless tokens issued before a role, password or user change.
+
+    Call ``invalidate_token_version`` once the change is committed.
+    """
+    user.token_version = (user.token_version or 0) + 1
+
+
+def invalidate_token_version(*user_ids: Optional[int]) -> None:
+    ids = [user_id for user_id in user_ids if user_id is not None]
+    for user_id in ids:
+        _version_cache.pop(user_id, None)
+    if ids:
+        publish_auth_invalidation({"user_ids": ids})
+
+
+async def current_token_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    """Return the user's token_version (None if deleted), briefly cached."""
+    now = time.monotonic()
+    cached = _version_cache.get(user_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    result = await db.execute(select(User.token_version).where(User.id == user_id))
+    row = result.first()
+    version = None if row is None else (row[0] or 0)
+    if TOKEN_VERSION_CACHE_TTL > 0:
+        _version_cache[user_id] = (now + TOKEN_VERSION_CACHE_TTL, version)
+    return version
+
+
+def token_claims(user: User) -> dict:
+    """Claims for an access token; stateless mode also embeds the role.
+
+    ``tenant_id`` is always included so the rate limiter can key per-tenant
+    policies without a database lookup.
+    """
+    claims = {"sub": user.username, "tenant_id": user.tenant_id}
+    if settings.stateless_auth:
+        claims.update(
+            {
+                "uid": user.id,
+                "role": user.role,
+                "ver": user.token_version or 0,
+            }
+        )
+    return claims
+
+
+async def principal_from_token(db: AsyncSession, token: str) -> Optional[User]:
+    """Resolve a bearer token to a user, or ``None`` if it is not valid.
+
+    Stateless tokens are trusted for tenant and role as long as their
+    ``ver`` matches the user's current token_version.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    if settings.stateless_auth and "ver" in payload:
+        user_id = payload.get("uid")
+        if user_id is None:
+            return None
+        if await current_token_version(db, user_id) != payload["ver"]:
+            return None
+        return User(
+            id=user_id,
+            username=username,
+            role=payload.get("role"),
+            tenant_id=payload.get("tenant_id"),
+        )
+    return await resolve_principal(db, username)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
@@ -59,15 +315,8 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalars().first()
+    with tracing.span("auth.get_current_user"):
+        user = await principal_from_token(db, token)
     if user is None:
         raise credentials_exception
     return user
@@ -97,6 +346,6 @@ async def login_for_access_token(
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
@@ -1,47 +1,407 @@
+"""Concurrent mixed-workload load generator for the API.
+
+Registers ``--tenants`` tenants with ``--users`` users each, seeds every
+tenant with ``--items`` items, then drives a weighted mix of reads and
+writes:
+
+* closed loop (default): ``--concurrency`` workers each send the next
+  request as soon as the previous one returns;
+* open loop (``--rate``): requests arrive as a Poisson process at the given
+  rate whether or not earlier ones finished. Latency is measured from the
+  scheduled arrival, so a slow server is not hidden by a slow client.
+
+Per endpoint it reports p50/p95/p99/max latency, a latency histogram and
+the error rate. ``--json`` writes the same figures for comparing builds.
+
+The API has no issue/return routes; the write side of the mix is restocking
+(``add``, which updates the existing row) and ``update``.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
 import asyncio
-import httpx
+import json
+import math
+import random
 import time
-import argparse
 
+import httpx
+
+DEFAULT_MIX = "status=40,history=15,usage=10,add=15,update=15,export=5"
+# Upper bounds (ms) of the latency histogram buckets
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """``"status=40,add=10"`` -> ``{"status": 40.0, "add": 10.0}``."""
+    mix: Dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The mix needs at least one positively weighted operation")
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.statuses: Dict[str, int] = {}
+
+    def record(self, latency: float, status: Optional[int]) -> None:
+        self.latencies.append(latency)
+        key = str(status) if status is not None else "exception"
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if status is None or status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> dict:
+        values = sorted(self.latencies)
+        count = len(values)
+        histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        for value in values:
+            index = next(
+                (
+                    i
+                    for i, bound in enumerate(HISTOGRAM_BOUNDS_MS)
+                    if value * 1000 <= bound
+                ),
+                len(HISTOGRAM_BOUNDS_MS),
+            )
+            histogram[index] += 1
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "rps": count / elapsed if elapsed else 0.0,
+            "mean_ms": sum(values) / count * 1000 if count else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000 if values else 0.0,
+            "statuses": self.statuses,
+            "histogram_ms": {
+                **{
+                    f"le_{bound}": n for bound, n in zip(HISTOGRAM_BOUNDS_MS, histogram)
+                },
+                "inf": histogram[-1],
+            },
+        }
+
+
+class Session:
+    """An authenticated user and the items of their tenant."""
+
+    def __init__(self, tenant_id: int, token: str, items: List[str]) -> None:
+        self.tenant_id = tenant_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.items = items
+
+
+Request = Tuple[str, str, dict]
+
+
+def _status(s: Session, rng: random.Random) -> Request:
+    return "GET", "/items/status", {"params": {"tenant_id": s.tenant_id}}
+
+
+def _history(s: Session, rng: random.Random) -> Request:
+    params = {"name": rng.choice(s.items), "tenant_id": s.tenant_id}
+    return "GET", "/items/history", {"params": params}
+
+
+def _usage(s: Session, rng: random.Random) -> Request:
+    path = f"/analytics/usage/{rng.choice(s.items)}"
+    return "GET", path, {"params": {"tenant_id": s.tenant_id}}
+
+
+def _add(s: Session, rng: random.Random) -> Request:
+    body = {
+        "name": rng.choice(s.items),
+        "quantity": 1,
+        "threshold": 0,
+        "min_par": 0,
+        "tenant_id": s.tenant_id,
+    }
+    return "POST", "/items/add", {"json": body}
+
+
+def _update(s: Session, rng: random.Random) -> Request:
+    body = {
+        "name": rng.choice(s.items),
+        "tenant_id": s.tenant_id,
+        "threshold": rng.randint(0, 10),
+    }
+    return "PUT", "/items/update", {"json": body}
 
-async def run_benchmark(url: str, iterations: int, tenant_id: int) -> None:
-    async with httpx.AsyncClient(base_url=url) as client:
-        # Authenticate and obtain token
+
+def _export(s: Session, rng: random.Random) -> Request:
+    params = {"tenant_id": s.tenant_id, "limit": 100}
+    return "GET", "/analytics/audit/export", {"params": params}
+
+
+OPERATIONS: Dict[str, Callable[[Session, random.Random], Request]] = {
+    "status": _status,
+    "history": _history,
+    "usage": _usage,
+    "add": _add,
+    "update": _update,
+    "export": _export,
+}
+
+
+async def _login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    # /token is rate limited; wait out 429s instead of failing the setup
+    while True:
         resp = await client.post(
-            "/token",
-            data={"username": "admin", "password": "admin"},
-        )
-        resp.raise_for_status()
-        token = resp.json()["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
-
-        # Warm-up request
-        await client.get(
-            "/items/status",
-            params={"tenant_id": tenant_id},
-            headers=headers,
+            "/token", data={"username": username, "password": password}
         )
+        if resp.status_code != 429:
+            resp.raise_for_status()
+            return resp.json()["access_token"]
+        await asyncio.sleep(float(resp.headers.get("Retry-After", 1)))
+
+
+async def setup(
+    client: httpx.AsyncClient, tenants: int, users: int, items: int, prefix: str
+) -> List[Session]:
+    """Register tenants, users and items for this run."""
+    sessions: List[Session] = []
+    password = "load-test-password"
+    for t in range(tenants):
+        tenant_id = None
+        tokens: List[str] = []
+        for u in range(users):
+            username = f"{prefix}-t{t}-u{u}"
+            resp = await client.post(
+                "/auth/register",
+                json={
+                    "username": username,
+                    "email": f"{username}@example.com",
+                    "password": password,
+                    "tenant_id": tenant_id,
+                    # usage and export need an admin or manager
+                    "is_admin": True,
+                },
+            )
+            resp.raise_for_status()
+            tenant_id = resp.json()["user"]["tenant_id"]
+            tokens.append(await _login(client, username, password))
 
-        start = time.perf_counter()
-        for _ in range(iterations):
-            r = await client.get(
-                "/items/status", params={"tenant_id": tenant_id}, headers=headers
+        names = [f"{prefix}-item{i}" for i in range(items)]
+        for name in names:
+            resp = await client.post(
+                "/items/add",
+                json={
+                    "name": name,
+                    "quantity": 1000,
+                    "threshold": 0,
+                    "min_par": 0,
+                    "tenant_id": tenant_id,
+                },
+                headers={"Authorization": f"Bearer {tokens[0]}"},
             )
-            r.raise_for_status()
-        duration = time.perf_counter() - start
-        rate = iterations / duration
-        print(f"{iterations} requests in {duration:.2f}s -> {rate:.2f} rps")
+            resp.raise_for_status()
+        sessions.extend(Session(tenant_id, token, names) for token in tokens)
+    return sessions
+
+
+class LoadRun:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        sessions: List[Session],
+        mix: Dict[str, float],
+        seed: Optional[int] = None,
+    ) -> None:
+        self.client = client
+        self.sessions = sessions
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.rng = random.Random(seed)
+        self.stats: Dict[str, EndpointStats] = {
+            name: EndpointStats() for name in self.names
+        }
+        self.dropped = 0
+
+    async def one(self, scheduled: Optional[float] = None) -> None:
+        name = self.rng.choices(self.names, self.weights)[0]
+        session = self.rng.choice(self.sessions)
+        method, path, kwargs = OPERATIONS[name](session, self.rng)
+        start = time.perf_counter() if scheduled is None else scheduled
+        try:
+            resp = await self.client.request(
+                method, path, headers=session.headers, **kwargs
+            )
+            status: Optional[int] = resp.status_code
+        except httpx.HTTPError:
+            status = None
+        self.stats[name].record(time.perf_counter() - start, status)
+
+    async def closed_loop(self, concurrency: int, deadline: float) -> None:
+        async def worker() -> None:
+            while time.perf_counter() < deadline:
+                await self.one()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, deadline: float, max_in_flight: int) -> None:
+        in_flight: set = set()
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(in_flight) >= max_in_flight:
+                self.dropped += 1
+            else:
+                task = asyncio.ensure_future(self.one(scheduled=next_at))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            next_at += self.rng.expovariate(rate)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    def report(self, elapsed: float, config: dict) -> dict:
+        endpoints = {name: stats.summary(elapsed) for name, stats in self.stats.items()}
+        total = EndpointStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+            for key, n in stats.statuses.items():
+                total.statuses[key] = total.statuses.get(key, 0) + n
+        return {
+            "config": config,
+            "elapsed_s": elapsed,
+            "dropped": self.dropped,
+            "total": total.summary(elapsed),
+            "endpoints": endpoints,
+        }
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    duration: float,
+    concurrency: int = 10,
+    rate: Optional[float] = None,
+    mix: str = DEFAULT_MIX,
+    tenants: int = 3,
+    users: int = 2,
+    items: int = 20,
+    max_in_flight: int = 1000,
+    seed: Optional[int] = None,
+    prefix: Optional[str] = None,
+) -> dict:
+    """Set up the data, drive the workload for ``duration`` seconds, report."""
+    weights = parse_mix(mix)
+    prefix = prefix or f"load{int(time.time())}"
+    sessions = await setup(client, tenants, users, items, prefix)
+    run = LoadRun(client, sessions, weights, seed)
+    start = time.perf_counter()
+    deadline = start + duration
+    if rate:
+        await run.open_loop(rate, deadline, max_in_flight)
+    else:
+        await run.closed_loop(concurrency, deadline)
+    config = {
+        "mode": "open" if rate else "closed",
+        "duration_s": duration,
+        "concurrency": None if rate else concurrency,
+        "rate": rate,
+        "mix": weights,
+        "tenants": tenants,
+        "users": users,
+        "items": items,
+    }
+    return run.report(time.perf_counter() - start, config)
+
+
+def format_report(report: dict) -> str:
+    header = (
+        f"{'endpoint':<10}{'count':>8}{'rps':>9}{'err%':>7}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)"
+    )
+    lines = [header]
+    rows = list(report["endpoints"].items()) + [("total", report["total"])]
+    for name, s in rows:
+        lines.append(
+            f"{name:<10}{s['count']:>8}{s['rps']:>9.1f}{s['error_rate'] * 100:>7.1f}"
+            f"{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}"
+            f"{s['max_ms']:>9.1f}"
+        )
+    if report["dropped"]:
+        lines.append(f"{report['dropped']} arrivals dropped at --max-in-flight")
+    return "\n".join(lines)
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Benchmark the /items/status route")
+    parser = argparse.ArgumentParser(description="Mixed-workload API load generator")
     parser.add_argument("--url", default="http://localhost:8000", help="Base API URL")
     parser.add_argument(
-        "--iterations", type=int, default=100, help="Number of requests"
+        "--duration", type=float, default=30, help="Seconds to apply load"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="Closed-loop workers"
     )
-    parser.add_argument("--tenant-id", type=int, default=1, help="Tenant ID to query")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Open-loop arrivals per second (Poisson); overrides --concurrency",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=1000,
+        help="Open-loop cap on outstanding requests; extra arrivals are dropped",
+    )
+    parser.add_argument(
+        "--mix", default=DEFAULT_MIX, help="Weighted operations, name=weight,..."
+    )
+    parser.add_argument("--tenants", type=int, default=3, help="Tenants to create")
+    parser.add_argument("--users", type=int, default=2, help="Users per tenant")
+    parser.add_argument("--items", type=int, default=20, help="Items per tenant")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--json", default=None, help="Write the report to this file")
     args = parser.parse_args()
-    asyncio.run(run_benchmark(args.url, args.iterations, args.tenant_id))
+
+    async def run() -> dict:
+        limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+        async with httpx.AsyncClient(
+            base_url=args.url, limits=limits, timeout=30
+        ) as client:
+            return await run_load(
+                client,
+                args.duration,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                mix=args.mix,
+                tenants=args.tenants,
+                users=args.users,
+                items=args.items,
+                max_in_flight=args.max_in_flight,
+                seed=args.seed,
+            )
+
+    report = asyncio.run(run())
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
 
 
 if __name__ == "__main__":
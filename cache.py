@@ -5,6 +5,14 @@ from typing import List
 import redis
 
 from config import settings
+import metrics
+import tracing
+
+cache_requests = metrics.counter(
+    "cache_requests_total",
+    "Redis cache lookups and writes by result",
+    ("operation", "result"),
+)
 
 
 @lru_cache()
@@ -15,24 +23,33 @@ def get_redis() -> redis.Redis | None:
         return None
 
 
+@tracing.traced("cache.get_cached")
 def get_cached(key: str) -> List[dict] | None:
     client = get_redis()
     if not client:
+        cache_requests.inc("get", "unavailable")
         return None
     try:
         value = client.get(key)
         if value is not None:
-            return json.loads(value)
+            result = json.loads(value)
+            cache_requests.inc("get", "hit")
+            return result
     except Exception:
+        cache_requests.inc("get", "error")
         return None
+    cache_requests.inc("get", "miss")
     return None
 
 
+@tracing.traced("cache.set_cached")
 def set_cached(key: str, value: List[dict], ttl: int) -> None:
     client = get_redis()
     if not client:
+        cache_requests.inc("set", "unavailable")
         return
     try:
         client.setex(key, ttl, json.dumps(value))
+        cache_requests.inc("set", "ok")
     except Exception:
-        pass
+        cache_requests.inc("set", "error")
@@ -25,6 +25,49 @@ class Settings(BaseSettings):
             env_file = ".env"
 
     database_url: str = Field("sqlite:///./inventory.db", env="DATABASE_URL")
+    # Create missing tables on startup unless Alembic manages the schema
+    db_create_all: bool = Field(True, env="DB_CREATE_ALL")
+    # Optional read replica for read-only routes (falls back to the primary)
+    database_replica_url: str | None = Field(None, env="DATABASE_REPLICA_URL")
+    async_database_replica_url: str | None = Field(
+        None, env="ASYNC_DATABASE_REPLICA_URL"
+    )
+    # Seconds a client's reads stay on the primary after it writes; 0 disables
+    read_your_writes_seconds: float = Field(5.0, env="READ_YOUR_WRITES_SECONDS")
+    # PRAGMAs applied to every SQLite connection (see sqlite_profile.py)
+    sqlite_profile: bool = Field(True, env="SQLITE_PROFILE")
+    sqlite_journal_mode: str = Field("WAL", env="SQLITE_JOURNAL_MODE")
+    sqlite_synchronous: str = Field("NORMAL", env="SQLITE_SYNCHRONOUS")
+    sqlite_busy_timeout_ms: int = Field(5000, env="SQLITE_BUSY_TIMEOUT_MS")
+    sqlite_mmap_size: int = Field(256 * 1024 * 1024, env="SQLITE_MMAP_SIZE")
+    # Negative values are KiB: -65536 is a 64 MiB page cache per connection
+    sqlite_cache_size: int = Field(-65536, env="SQLITE_CACHE_SIZE")
+    # Let only one coroutine per process write through the async engine at once
+    sqlite_serialize_writes: bool = Field(True, env="SQLITE_SERIALIZE_WRITES")
+    # Connection pool for both the sync and async engines
+    db_pool_size: int = Field(5, env="DB_POOL_SIZE")
+    db_max_overflow: int = Field(10, env="DB_MAX_OVERFLOW")
+    db_pool_recycle: int = Field(1800, env="DB_POOL_RECYCLE")
+    db_pool_pre_ping: bool = Field(True, env="DB_POOL_PRE_PING")
+    db_pool_timeout: float = Field(30.0, env="DB_POOL_TIMEOUT")
+    # Add X-DB-Queries/X-DB-Time-ms headers to every response
+    debug: bool = Field(False, env="DEBUG")
+    # Log requests issuing more statements than this (0 disables)
+    sql_query_budget: int = Field(25, env="SQL_QUERY_BUDGET")
+    # Log statements repeated this often in one request as likely N+1 patterns
+    sql_repeat_threshold: int = Field(5, env="SQL_REPEAT_THRESHOLD")
+    # Where request profiles (collapsed stacks) are written
+    profile_dir: str = Field("profiles", env="PROFILE_DIR")
+    # Fraction of requests profiled to PROFILE_DIR (0 disables)
+    profile_sample_rate: float = Field(0.0, env="PROFILE_SAMPLE_RATE")
+    profile_interval: float = Field(0.005, env="PROFILE_INTERVAL")
+    profile_max_files: int = Field(200, env="PROFILE_MAX_FILES")
+    # Trace exporter: "console", "file" or empty to disable tracing
+    tracing_exporter: str = Field("", env="TRACING_EXPORTER")
+    tracing_file: str = Field("traces.jsonl", env="TRACING_FILE")
+    # Fraction of new traces recorded (incoming traceparents are always kept)
+    tracing_sample_rate: float = Field(1.0, env="TRACING_SAMPLE_RATE")
+    tracing_service_name: str = Field("stock-saas", env="TRACING_SERVICE_NAME")
     secret_key: str | None = Field(None, env="SECRET_KEY")
     secret_store_file: str | None = Field(None, env="SECRET_STORE_FILE")
     admin_username: str | None = Field(None, env="ADMIN_USERNAME")
@@ -34,12 +77,51 @@ class Settings(BaseSettings):
     celery_broker_url: str = Field("redis://localhost:6379/0", env="CELERY_BROKER_URL")
     redis_url: str = Field("redis://localhost:6379/1", env="REDIS_URL")
     rate_limit_redis_url: str = Field("memory://", env="RATE_LIMIT_REDIS_URL")
+    # Clients tracked by the memory:// limiter before the least recent are dropped
+    rate_limit_max_keys: int = Field(100_000, env="RATE_LIMIT_MAX_KEYS")
+    # Extra policies, e.g. "/analytics=30/60:tenant,/items/export=5/60:user"
+    rate_limit_policies: str = Field("", env="RATE_LIMIT_POLICIES")
     stock_check_interval: int = Field(3600, env="STOCK_CHECK_INTERVAL")
+    # Serve Celery worker metrics from this port (each pool process takes the
+    # next free one); unset to disable
+    worker_metrics_port: int | None = Field(None, env="WORKER_METRICS_PORT")
+    worker_metrics_host: str = Field("127.0.0.1", env="WORKER_METRICS_HOST")
+    # Bearer token scrapers must send; the API's /metrics is off when unset
+    metrics_token: str | None = Field(None, env="METRICS_TOKEN")
     async_database_url: str | None = Field(None, env="ASYNC_DATABASE_URL")
     slack_webhook_url: str | None = Field(None, env="SLACK_WEBHOOK_URL")
     smtp_server: str | None = Field(None, env="SMTP_SERVER")
     alert_email_to: str | None = Field(None, env="ALERT_EMAIL_TO")
     alert_email_from: str = Field("noreply@example.com", env="ALERT_EMAIL_FROM")
+    # Seconds an authenticated user is cached; 0 disables the cache
+    principal_cache_ttl: float = Field(30.0, env="PRINCIPAL_CACHE_TTL")
+    # bcrypt thread pool; requests beyond max pending get a 503
+    password_hash_workers: int = Field(4, env="PASSWORD_HASH_WORKERS")
+    password_hash_max_pending: int = Field(64, env="PASSWORD_HASH_MAX_PENDING")
+    user_import_max_rows: int = Field(1000, env="USER_IMPORT_MAX_ROWS")
+    # Embed tenant and role claims in tokens and skip the per-request user lookup
+    stateless_auth: bool = Field(False, env="STATELESS_AUTH")
+    token_version_cache_ttl: float = Field(30.0, env="TOKEN_VERSION_CACHE_TTL")
+    ws_broker_url: str = Field("memory://", env="WS_BROKER_URL")
+    # Seconds during which item change events are merged (0 disables)
+    ws_coalesce_window: float = Field(0.1, env="WS_COALESCE_WINDOW")
+    ws_replay_buffer_size: int = Field(1000, env="WS_REPLAY_BUFFER_SIZE")
+    # Replay buffers are kept this many seconds after a tenant's last local
+    # socket leaves, for at most this many idle tenants per worker
+    ws_replay_ttl: float = Field(300.0, env="WS_REPLAY_TTL")
+    ws_replay_max_tenants: int = Field(1000, env="WS_REPLAY_MAX_TENANTS")
+    ws_send_queue_size: int = Field(256, env="WS_SEND_QUEUE_SIZE")
+    # "disconnect" or "drop" when a websocket's send queue is full
+    ws_overflow_policy: str = Field("disconnect", env="WS_OVERFLOW_POLICY")
+    ws_max_connections_per_tenant: int = Field(500, env="WS_MAX_CONNECTIONS_PER_TENANT")
+    ws_heartbeat_interval: float = Field(20.0, env="WS_HEARTBEAT_INTERVAL")
+    ws_heartbeat_timeout: float = Field(60.0, env="WS_HEARTBEAT_TIMEOUT")
+    notification_send_timeout: float = Field(10.0, env="NOTIFICATION_SEND_TIMEOUT")
+    outbox_dispatch_interval: int = Field(30, env="OUTBOX_DISPATCH_INTERVAL")
+    outbox_batch_size: int = Field(100, env="OUTBOX_BATCH_SIZE")
+    outbox_max_attempts: int = Field(6, env="OUTBOX_MAX_ATTEMPTS")
+    outbox_backoff_base: int = Field(30, env="OUTBOX_BACKOFF_BASE")
+    outbox_backoff_max: int = Field(3600, env="OUTBOX_BACKOFF_MAX")
 
 
 @lru_cache()
@@ -1,22 +1,128 @@
+import logging
+import threading
+
 from config import settings
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+
+from db_pool import engine_options, lazy_bind_session
+from read_routing import prefer_primary
+from sqlite_profile import apply_sqlite_profile, is_sqlite
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.database_url
+DATABASE_REPLICA_URL = settings.database_replica_url
+
+# Engines are created on first use (see get_engine) so importing this module,
+# e.g. from the CLI or a worker, stays cheap. ``database.engine`` still works.
+_engine_lock = threading.Lock()
+
+
+def _create_engine(url: str, label: str):
+    if is_sqlite(url):  # dev mode
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            **engine_options(url, label),
+        )
+        if settings.sqlite_profile:
+            apply_sqlite_profile(engine)
+        return engine
+    return create_engine(url, **engine_options(url, label))
+
+
+def _lazy_global(name: str, factory):
+    value = globals().get(name)
+    if value is None:
+        with _engine_lock:
+            value = globals().get(name)
+            if value is None:
+                value = globals()[name] = factory()
+    return value
+
+
+def get_engine():
+    return _lazy_global("engine", lambda: _create_engine(DATABASE_URL, "primary"))
+
+
+def get_replica_engine():
+    if not DATABASE_REPLICA_URL:
+        return None
+    return _lazy_global(
+        "replica_engine", lambda: _create_engine(DATABASE_REPLICA_URL, "replica")
+    )
+
+
+def __getattr__(name: str):
+    if name == "engine":
+        return get_engine()
+    if name == "replica_engine":
+        return get_replica_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-if DATABASE_URL.startswith("sqlite"):  # dev mode
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(
+    class_=lazy_bind_session(Session, get_engine),
+    autocommit=False,
+    autoflush=False,
+)
+
+ReadSessionLocal = None
+if DATABASE_REPLICA_URL:
+    ReadSessionLocal = sessionmaker(
+        class_=lazy_bind_session(Session, get_replica_engine),
+        autocommit=False,
+        autoflush=False,
+    )
 
 Base = declarative_base()
 
 
+def init_schema() -> bool:
+    """Create missing tables unless Alembic manages the schema.
+
+    Returns ``True`` when ``create_all`` ran. Skipped when ``DB_CREATE_ALL`` is
+    off or the database has an ``alembic_version`` table.
+    """
+    if not settings.db_create_all:
+        return False
+    engine = get_engine()
+    with engine.connect() as conn:
+        if inspect(conn).has_table("alembic_version"):
+            return False
+    import models  # noqa: F401  (register every table on Base.metadata)
+
+    Base.metadata.create_all(bind=engine)
+    return True
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    """Session for read-only routes: the replica when configured and healthy.
+
+    Falls back to the primary when there is no replica, the replica cannot be
+    reached, or the client recently wrote (see ``read_routing``).
+    """
+    if ReadSessionLocal is None or prefer_primary.get():
+        yield from get_db()
+        return
+    db = ReadSessionLocal()
+    try:
+        db.connection()
+    except OperationalError:
+        logger.warning("Read replica unavailable, falling back to primary")
+        db.close()
+        db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
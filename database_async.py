@@ -1,21 +1,99 @@
+import logging
+import threading
+
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import Session, declarative_base
 
 from config import settings
+from db_pool import engine_options, lazy_bind_session
+from read_routing import prefer_primary
+from sqlite_profile import SerializedWriteSession, apply_sqlite_profile, is_sqlite
 
-# Build async database URL from DATABASE_URL when ASYNC_DATABASE_URL isn't set
-ASYNC_DATABASE_URL = settings.async_database_url
-if not ASYNC_DATABASE_URL:
-    db_url = settings.database_url
+logger = logging.getLogger(__name__)
+
+
+def _to_async_url(db_url: str) -> str:
     if db_url.startswith("postgresql://"):
-        ASYNC_DATABASE_URL = db_url.replace("postgresql://", "postgresql+asyncpg://")
-    elif db_url.startswith("sqlite://"):
-        ASYNC_DATABASE_URL = db_url.replace("sqlite:///", "sqlite+aiosqlite:///")
-    else:
-        ASYNC_DATABASE_URL = db_url
+        return db_url.replace("postgresql://", "postgresql+asyncpg://")
+    if db_url.startswith("sqlite://"):
+        return db_url.replace("sqlite:///", "sqlite+aiosqlite:///")
+    return db_url
+
+
+# Build async database URL from DATABASE_URL when ASYNC_DATABASE_URL isn't set
+ASYNC_DATABASE_URL = settings.async_database_url or _to_async_url(settings.database_url)
+ASYNC_DATABASE_REPLICA_URL = settings.async_database_replica_url or (
+    _to_async_url(settings.database_replica_url)
+    if settings.database_replica_url
+    else None
+)
+
+# Created on first use like the sync engines; ``async_engine`` still works.
+_engine_lock = threading.Lock()
+
+
+def _create_async_engine(url: str, label: str):
+    engine = create_async_engine(
+        url, future=True, **engine_options(url, label, is_async=True)
+    )
+    if is_sqlite(url) and settings.sqlite_profile:
+        apply_sqlite_profile(engine.sync_engine)
+    return engine
+
+
+def _lazy_global(name: str, factory):
+    value = globals().get(name)
+    if value is None:
+        with _engine_lock:
+            value = globals().get(name)
+            if value is None:
+                value = globals()[name] = factory()
+    return value
 
-async_engine = create_async_engine(ASYNC_DATABASE_URL, future=True)
-AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+def get_async_engine():
+    return _lazy_global(
+        "async_engine",
+        lambda: _create_async_engine(ASYNC_DATABASE_URL, "primary_async"),
+    )
+
+
+def get_async_replica_engine():
+    if not ASYNC_DATABASE_REPLICA_URL:
+        return None
+    return _lazy_global(
+        "async_replica_engine",
+        lambda: _create_async_engine(ASYNC_DATABASE_REPLICA_URL, "replica_async"),
+    )
+
+
+def __getattr__(name: str):
+    if name == "async_engine":
+        return get_async_engine()
+    if name == "async_replica_engine":
+        return get_async_replica_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_sync_session_class = Session
+if is_sqlite(ASYNC_DATABASE_URL) and settings.sqlite_serialize_writes:
+    _sync_session_class = SerializedWriteSession
+AsyncSessionLocal = async_sessionmaker(
+    expire_on_commit=False,
+    sync_session_class=lazy_bind_session(
+        _sync_session_class, lambda: get_async_engine().sync_engine
+    ),
+)
+
+AsyncReadSessionLocal = None
+if ASYNC_DATABASE_REPLICA_URL:
+    AsyncReadSessionLocal = async_sessionmaker(
+        expire_on_commit=False,
+        sync_session_class=lazy_bind_session(
+            Session, lambda: get_async_replica_engine().sync_engine
+        ),
+    )
 
 Base = declarative_base()
 
@@ -25,4 +103,27 @@ async def get_async_db():
         yield session
 
 
-__all__ = ["async_engine", "AsyncSessionLocal", "Base", "get_async_db"]
+async def get_async_read_db():
+    """Async counterpart of ``database.get_read_db``."""
+    if AsyncReadSessionLocal is None or prefer_primary.get():
+        async with AsyncSessionLocal() as session:
+            yield session
+        return
+    session = AsyncReadSessionLocal()
+    try:
+        await session.connection()
+    except OperationalError:
+        logger.warning("Read replica unavailable, falling back to primary")
+        await session.close()
+        session = AsyncSessionLocal()
+    async with session:
+        yield session
+
+
+__all__ = [
+    "get_async_engine",
+    "AsyncSessionLocal",
+    "Base",
+    "get_async_db",
+    "get_async_read_db",
+]
@@ -0,0 +1,123 @@
+"""Engine and pool settings plus checkout telemetry shared by both engines."""
+
+from typing import Callable, Dict, Type
+import time
+import weakref
+
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+from config import settings
+import metrics
+
+checkout_wait = metrics.histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    ("engine",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+overflow_checkouts = metrics.counter(
+    "db_pool_overflow_checkouts_total",
+    "Connections opened beyond pool_size (max_overflow in use)",
+    ("engine",),
+)
+checkout_timeouts = metrics.counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after pool_timeout",
+    ("engine",),
+)
+
+_pools: "weakref.WeakValueDictionary[str, Pool]" = weakref.WeakValueDictionary()
+
+
+def _in_use() -> Dict[tuple, float]:
+    return {(name,): pool.checkedout() for name, pool in list(_pools.items())}
+
+
+def _overflow() -> Dict[tuple, float]:
+    return {(name,): max(pool.overflow(), 0) for name, pool in list(_pools.items())}
+
+
+metrics.gauge(
+    "db_pool_connections_in_use",
+    "Database connections currently checked out",
+    ("engine",),
+    callback=_in_use,
+)
+metrics.gauge(
+    "db_pool_overflow",
+    "Database connections currently open beyond pool_size",
+    ("engine",),
+    callback=_overflow,
+)
+
+
+class _InstrumentedPoolMixin:
+    """Times ``_do_get`` (the wait for a free connection) on a QueuePool."""
+
+    engine_label = "default"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        _pools[self.engine_label] = self
+
+    def _do_get(self):
+        start = time.perf_counter()
+        before = self._overflow
+        try:
+            entry = super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc(self.engine_label)
+            raise
+        finally:
+            checkout_wait.observe(time.perf_counter() - start, self.engine_label)
+        if self._overflow > before and self._overflow > 0:
+            overflow_checkouts.inc(self.engine_label)
+        return entry
+
+
+def instrumented_pool(base: Type[QueuePool], label: str) -> Type[QueuePool]:
+    """A ``base`` subclass reporting pool metrics under ``engine=label``."""
+    return type(
+        f"Instrumented{base.__name__}",
+        (_InstrumentedPoolMixin, base),
+        {"engine_label": label},
+    )
+
+
+def engine_options(url: str, label: str, is_async: bool = False) -> dict:
+    """Pool keyword arguments for ``create_engine``/``create_async_engine``.
+
+    In-memory SQLite keeps SQLAlchemy's default single-connection pool, which
+    has nothing to size or measure.
+    """
+    if ":memory:" in url or url in ("sqlite://", "sqlite+aiosqlite://"):
+        return {}
+    base = AsyncAdaptedQueuePool if is_async else QueuePool
+    return {
+        "poolclass": instrumented_pool(base, label),
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_timeout": settings.db_pool_timeout,
+    }
+
+
+def lazy_bind_session(
+    base: Type[Session], engine_factory: Callable[[], Engine]
+) -> Type[Session]:
+    """A ``base`` subclass that binds to ``engine_factory()`` on first use.
+
+    Lets session factories be declared at import time without creating the
+    engine (and its pool) until a session actually needs a connection.
+    """
+
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = engine_factory()
+        return base.get_bind(self, *args, **kwargs)
+
+    return type(f"Lazy{base.__name__}", (base,), {"get_bind": get_bind})
@@ -0,0 +1,241 @@
+"""Cross-process fan-out of tenant websocket events.
+
+Any process (API worker or Celery task) publishes events with
+``publish_event``. Each API worker runs an ``EventRelay`` that listens on the
+broker and hands the messages to its local ``InventoryWSManager``.
+
+``publish_event`` stamps every event with a per-tenant ``seq`` taken from the
+broker (a Redis ``INCR`` for ``RedisBroker``), so all workers see the same
+number for the same event and a client can resume on any of them.
+
+The relay also applies ``publish_auth_invalidation`` messages so a user
+changed or deleted on one worker is dropped from every worker's auth caches.
+"""
+
+from functools import lru_cache
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, List, Tuple
+import asyncio
+import atexit
+import json
+import logging
+import threading
+
+import redis
+import redis.asyncio as aioredis
+
+from config import settings
+
+if TYPE_CHECKING:
+    from websocket_manager import InventoryWSManager
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "inventory:"
+SEQ_KEY_PREFIX = "inventory-seq:"
+# Cached principal / token version invalidations for every API worker
+AUTH_CHANNEL = f"{CHANNEL_PREFIX}auth"
+
+
+def tenant_channel(tenant_id: int) -> str:
+    return f"{CHANNEL_PREFIX}{tenant_id}"
+
+
+class InMemoryBroker:
+    """Single process stand-in for Redis pub/sub used in development and tests."""
+
+    def __init__(self) -> None:
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._lock = threading.Lock()
+        self._seq: Dict[int, int] = {}
+
+    def next_seq(self, tenant_id: int) -> int:
+        with self._lock:
+            seq = self._seq[tenant_id] = self._seq.get(tenant_id, 0) + 1
+        return seq
+
+    def publish(self, channel: str, message: str) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, (channel, message))
+
+    async def listen(self) -> AsyncIterator[Tuple[str, str]]:
+        entry = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.append(entry)
+        try:
+            while True:
+                yield await entry[1].get()
+        finally:
+            with self._lock:
+                self._subscribers.remove(entry)
+
+
+class RedisBroker:
+    """Redis pub/sub broker shared by every API and Celery worker."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._client: redis.Redis | None = None
+
+    def _sync_client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def next_seq(self, tenant_id: int) -> int:
+        return int(self._sync_client().incr(f"{SEQ_KEY_PREFIX}{tenant_id}"))
+
+    def publish(self, channel: str, message: str) -> None:
+        self._sync_client().publish(channel, message)
+
+    async def listen(self) -> AsyncIterator[Tuple[str, str]]:
+        client = aioredis.from_url(self.url, decode_responses=True)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+        try:
+            async for msg in pubsub.listen():
+                if msg["type"] == "pmessage":
+                    yield msg["channel"], msg["data"]
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+@lru_cache()
+def get_broker() -> InMemoryBroker | RedisBroker:
+    url = settings.ws_broker_url
+    if url == "memory://":
+        return InMemoryBroker()
+    return RedisBroker(url)
+
+
+def publish_event(
+    tenant_id: int, data: dict, broker: InMemoryBroker | RedisBroker | None = None
+) -> None:
+    """Publish a tenant event to every API worker; never raises."""
+    broker = broker or get_broker()
+    try:
+        stamped = {"seq": broker.next_seq(tenant_id), **data}
+        broker.publish(
+            tenant_channel(tenant_id), json.dumps(stamped, separators=(",", ":"))
+        )
+    except Exception:
+        logger.exception("Failed to publish event for tenant %s", tenant_id)
+
+
+def publish_auth_invalidation(
+    data: dict, broker: InMemoryBroker | RedisBroker | None = None
+) -> None:
+    """Ask every API worker to drop cached auth state; never raises."""
+    broker = broker or get_broker()
+    try:
+        broker.publish(AUTH_CHANNEL, json.dumps(data, separators=(",", ":")))
+    except Exception:
+        logger.exception("Failed to publish auth invalidation")
+
+
+class EventCoalescer:
+    """Merge bursts of per-item change events before publishing.
+
+    Events are keyed by tenant and item; within ``window`` seconds only the
+    latest event for each item is kept, so a burst of scans results in one
+    message per item.
+    """
+
+    def __init__(
+        self,
+        window: float | None = None,
+        publish: Callable[[int, dict], None] | None = None,
+    ) -> None:
+        self.window = settings.ws_coalesce_window if window is None else window
+        self._publish = publish or publish_event
+        self._pending: Dict[Tuple[int, object], dict] = {}
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    def add(self, tenant_id: int, key: object, data: dict) -> None:
+        if self.window <= 0:
+            self._publish(tenant_id, data)
+            return
+        with self._lock:
+            # Re-insert so flush order follows the latest change
+            self._pending.pop((tenant_id, key), None)
+            self._pending[(tenant_id, key)] = data
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        for (tenant_id, _), data in pending.items():
+            self._publish(tenant_id, data)
+
+
+change_coalescer = EventCoalescer()
+atexit.register(change_coalescer.flush)
+
+
+def publish_change(tenant_id: int, item_id: int, data: dict) -> None:
+    """Queue an item change event for coalesced publication."""
+    change_coalescer.add(tenant_id, item_id, data)
+
+
+class EventRelay:
+    """Forward broker messages to the sockets connected to this process."""
+
+    def __init__(
+        self,
+        manager: "InventoryWSManager",
+        broker: InMemoryBroker | RedisBroker | None = None,
+        retry_delay: float = 1.0,
+        on_auth_invalidation: Callable[[str], None] | None = None,
+    ) -> None:
+        self.manager = manager
+        self.broker = broker
+        self.retry_delay = retry_delay
+        self.on_auth_invalidation = on_auth_invalidation
+        self._task: asyncio.Task | None = None
+
+    def ensure_started(self) -> None:
+        """Start listening on the running loop if not already doing so."""
+        loop = asyncio.get_running_loop()
+        task = self._task
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        broker = self.broker or get_broker()
+        while True:
+            try:
+                async for channel, message in broker.listen():
+                    if channel == AUTH_CHANNEL:
+                        if self.on_auth_invalidation is not None:
+                            self.on_auth_invalidation(message)
+                        continue
+                    if not channel.startswith(CHANNEL_PREFIX):
+                        continue
+                    try:
+                        tenant_id = int(channel[len(CHANNEL_PREFIX) :])
+                    except ValueError:
+                        continue
+                    self.manager.broadcast_text(tenant_id, message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Event relay lost its broker connection")
+            await asyncio.sleep(self.retry_delay)
@@ -6,10 +6,7 @@ from inventory_core import (
     return_item as core_return_item,
     get_status,
 )
-from database import SessionLocal, engine
-from models import Base
-
-Base.metadata.create_all(bind=engine)
+from database import SessionLocal, init_schema
 
 
 def add_item(db, name: str, qty: int, threshold: int, tenant_id: int):
@@ -71,6 +68,7 @@ def main():
 
     args = parser.parse_args()
 
+    init_schema()
     db = SessionLocal()
     try:
         tenant_id = args.tenant
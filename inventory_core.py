@@ -5,6 +5,47 @@ from models import Item, AuditLog
 from datetime import datetime
 from sqlalchemy import select, and_
 
+from event_bus import publish_change
+import metrics
+import tracing
+
+operation_duration = metrics.histogram(
+    "inventory_operation_duration_seconds",
+    "Time spent in inventory_core operations",
+    ("operation",),
+)
+operation_errors = metrics.counter(
+    "inventory_operation_errors_total",
+    "inventory_core operations that raised",
+    ("operation",),
+)
+_timed = metrics.timed(operation_duration, operation_errors)
+
+
+def instrumented(func):
+    """Time ``func`` for /metrics and run it in a tracing span."""
+    return _timed(tracing.traced(f"inventory_core.{func.__name__}")(func))
+
+
+def _change_event(item: Item, event: str = "update") -> dict:
+    return {
+        "event": event,
+        "item": item.name,
+        "item_id": item.id,
+        "available": item.available,
+        "in_use": item.in_use,
+        "threshold": item.threshold,
+        "department_id": item.department_id,
+        "category_id": item.category_id,
+    }
+
+
+def _emit(item: Item, event: str = "update", **extra) -> None:
+    """Publish a change event for a committed mutation."""
+    data = _change_event(item, event)
+    data.update(extra)
+    publish_change(item.tenant_id, item.id, data)
+
 
 def _log_action(
     db: Session, user_id: Optional[int], item: Item, action: str, quantity: int
@@ -19,6 +60,7 @@ def _log_action(
     db.add(log)
 
 
+@instrumented
 def add_item(
     db: Session,
     name: str,
@@ -70,9 +112,11 @@ def add_item(
     _log_action(db, user_id, item, "add", qty)
     db.commit()
     db.refresh(item)
+    _emit(item)
     return item
 
 
+@instrumented
 def issue_item(
     db: Session,
     name: str,
@@ -92,9 +136,11 @@ def issue_item(
     _log_action(db, user_id, item, "issue", qty)
     db.commit()
     db.refresh(item)
+    _emit(item)
     return item
 
 
+@instrumented
 def return_item(
     db: Session,
     name: str,
@@ -114,9 +160,11 @@ def return_item(
     _log_action(db, user_id, item, "return", qty)
     db.commit()
     db.refresh(item)
+    _emit(item)
     return item
 
 
+@instrumented
 def get_status(
     db: Session, tenant_id: int, name: Optional[str] = None
 ) -> Dict[str, dict]:
@@ -152,6 +200,7 @@ def get_status(
     return items
 
 
+@instrumented
 def get_recent_logs(
     db: Session, limit: int = 10, tenant_id: Optional[int] = None
 ) -> List[AuditLog]:
@@ -162,6 +211,7 @@ def get_recent_logs(
     return query.order_by(AuditLog.timestamp.desc()).limit(limit).all()
 
 
+@instrumented
 def get_item_history(
     db: Session, name: str, tenant_id: int, limit: int = 100
 ) -> List[AuditLog]:
@@ -178,6 +228,7 @@ def get_item_history(
     )
 
 
+@instrumented
 def update_item(
     db: Session,
     name: str,
@@ -219,9 +270,14 @@ def update_item(
 
     db.commit()
     db.refresh(item)
+    if item.name != name:
+        _emit(item, previous_name=name)
+    else:
+        _emit(item)
     return item
 
 
+@instrumented
 def delete_item(
     db: Session,
     name: str,
@@ -234,10 +290,13 @@ def delete_item(
         raise ValueError("Item not found")
 
     _log_action(db, user_id, item, "delete", 0)
+    event = _change_event(item, "delete")
     db.delete(item)
     db.commit()
+    publish_change(tenant_id, event["item_id"], event)
 
 
+@instrumented
 def transfer_item(
     db: Session,
     name: str,
@@ -283,6 +342,8 @@ def transfer_item(
     db.commit()
     db.refresh(from_item)
     db.refresh(to_item)
+    _emit(from_item, "transfer", quantity=qty, to_tenant_id=to_tenant_id)
+    _emit(to_item, "transfer", quantity=qty, from_tenant_id=from_tenant_id)
     return from_item, to_item
 
 
@@ -299,6 +360,7 @@ async def _async_log_action(
     db.add(log)
 
 
+@instrumented
 async def async_add_item(
     db: AsyncSession,
     name: str,
@@ -356,9 +418,11 @@ async def async_add_item(
     await _async_log_action(db, user_id, item, "add", qty)
     await db.commit()
     await db.refresh(item)
+    _emit(item)
     return item
 
 
+@instrumented
 async def async_issue_item(
     db: AsyncSession,
     name: str,
@@ -384,9 +448,11 @@ async def async_issue_item(
     await _async_log_action(db, user_id, item, "issue", qty)
     await db.commit()
     await db.refresh(item)
+    _emit(item)
     return item
 
 
+@instrumented
 async def async_return_item(
     db: AsyncSession,
     name: str,
@@ -412,9 +478,11 @@ async def async_return_item(
     await _async_log_action(db, user_id, item, "return", qty)
     await db.commit()
     await db.refresh(item)
+    _emit(item)
     return item
 
 
+@instrumented
 async def async_get_status(
     db: AsyncSession, tenant_id: int, name: Optional[str] = None
 ) -> Dict[str, dict]:
@@ -441,6 +509,7 @@ async def async_get_status(
     return items
 
 
+@instrumented
 async def async_get_recent_logs(
     db: AsyncSession, limit: int = 10, tenant_id: Optional[int] = None
 ) -> List[AuditLog]:
@@ -454,6 +523,7 @@ async def async_get_recent_logs(
     return result.scalars().all()
 
 
+@instrumented
 async def async_get_item_history(
     db: AsyncSession, name: str, tenant_id: int, limit: int = 100
 ) -> List[AuditLog]:
@@ -475,6 +545,7 @@ async def async_get_item_history(
     return result.scalars().all()
 
 
+@instrumented
 async def async_update_item(
     db: AsyncSession,
     name: str,
@@ -517,9 +588,14 @@ async def async_update_item(
 
     await db.commit()
     await db.refresh(item)
+    if item.name != name:
+        _emit(item, previous_name=name)
+    else:
+        _emit(item)
     return item
 
 
+@instrumented
 async def async_delete_item(
     db: AsyncSession,
     name: str,
@@ -535,10 +611,13 @@ async def async_delete_item(
         raise ValueError("Item not found")
 
     await _async_log_action(db, user_id, item, "delete", 0)
+    event = _change_event(item, "delete")
     await db.delete(item)
     await db.commit()
+    publish_change(tenant_id, event["item_id"], event)
 
 
+@instrumented
 async def async_transfer_item(
     db: AsyncSession,
     name: str,
@@ -584,4 +663,6 @@ async def async_transfer_item(
     await db.commit()
     await db.refresh(from_item)
     await db.refresh(to_item)
+    _emit(from_item, "transfer", quantity=qty, to_tenant_id=to_tenant_id)
+    _emit(to_item, "transfer", quantity=qty, from_tenant_id=from_tenant_id)
     return from_item, to_item
@@ -1,24 +1,23 @@
 from config import settings
 
-from fastapi import FastAPI, WebSocket, Depends
+from fastapi import FastAPI, WebSocket, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
 
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.websockets import WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from jose import JWTError, jwt
 
-from database import Base, engine, SessionLocal, DATABASE_URL
+from database import SessionLocal, DATABASE_URL, init_schema
+import database
 from database_async import get_async_db
 import database_async
 from auth import (
+    apply_auth_invalidation,
     login_for_access_token,
     require_role,
     get_password_hash,
-    SECRET_KEY,
-    ALGORITHM,
+    principal_from_token,
 )
 from models import User, Tenant
 from routers.users import router as users_router
@@ -28,8 +27,16 @@ from routers.audit import router as audit_router
 from routers.departments import router as departments_router
 from routers.categories import router as categories_router
 from routers.items import router as items_router
+from routers.admin import router as admin_router
 from websocket_manager import InventoryWSManager
-from rate_limiter import RateLimiter
+from event_bus import EventRelay
+from rate_limiter import RateLimiter, RateLimitMiddleware, parse_policies
+from read_routing import ReadYourWritesMiddleware
+from query_stats import QueryStatsMiddleware
+from request_metrics import RequestMetricsMiddleware
+from profiling import ProfilingMiddleware
+from tracing import TracingMiddleware
+import metrics
 
 
 app = FastAPI(
@@ -43,6 +50,9 @@ app = FastAPI(
 )
 
 ws_manager = InventoryWSManager()
+# Relays events published by any process (API or Celery) to local sockets
+# and applies auth cache invalidations from other workers
+event_relay = EventRelay(ws_manager, on_auth_invalidation=apply_auth_invalidation)
 
 # Configure CORS
 origins_raw = settings.cors_allow_origins or settings.next_public_api_url
@@ -67,12 +77,26 @@ rate_limiter = RateLimiter(
     window=60,
     routes=["/token", "/users"],
     redis_url=settings.rate_limit_redis_url or "redis://redis:6379/1",
+    max_keys=settings.rate_limit_max_keys,
+    policies=parse_policies(settings.rate_limit_policies),
 )
 app.state.rate_limiter = rate_limiter
-app.add_middleware(BaseHTTPMiddleware, dispatch=rate_limiter)
-
-# Initialize DB and Routers
-Base.metadata.create_all(bind=engine)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# Keep a client's reads on the primary briefly after it writes
+if database.ReadSessionLocal is not None:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# Count the SQL statements each request issues
+app.add_middleware(QueryStatsMiddleware)
+# Profile admin requests sent with X-Profile: 1 and PROFILE_SAMPLE_RATE of the rest
+app.add_middleware(ProfilingMiddleware)
+# Root span per request; continues an incoming traceparent
+app.add_middleware(TracingMiddleware)
+# Outermost, so latency includes every other middleware
+app.add_middleware(RequestMetricsMiddleware)
+
+# Routers
 app.include_router(users_router)
 app.include_router(analytics_router)
 app.include_router(auth_router)
@@ -80,11 +104,25 @@ app.include_router(departments_router)
 app.include_router(categories_router)
 app.include_router(items_router)
 app.include_router(audit_router)
+app.include_router(admin_router)
 
 
 @app.websocket("/ws/inventory/{tenant_id}")
 async def inventory_ws(websocket: WebSocket, tenant_id: int):
-    """Websocket endpoint broadcasting inventory updates scoped to a tenant."""
+    """Websocket endpoint broadcasting inventory updates scoped to a tenant.
+
+    Every event carries a per-tenant ``seq``. Reconnect with ``?since=<seq>``
+    to receive the events missed in between, or a ``resync_required`` event
+    when they are no longer buffered.
+
+    Send ``{"action": "subscribe", "items": [...], "department_id": ...,
+    "category_id": ..., "events": [...]}`` to only receive matching events,
+    and ``{"action": "unsubscribe"}`` to receive everything again.
+
+    The server sends ``{"event": "ping"}`` periodically; clients must send
+    something (e.g. ``{"action": "pong"}``) within ``WS_HEARTBEAT_TIMEOUT``
+    seconds or they are disconnected.
+    """
 
     token = websocket.query_params.get("token")
     if not token:
@@ -97,29 +135,38 @@ async def inventory_ws(websocket: WebSocket, tenant_id: int):
         return
 
     async with database_async.AsyncSessionLocal() as session:
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username = payload.get("sub")
-            if username is None:
-                raise JWTError
-        except JWTError:
-            await websocket.close(code=1008)
-            return
-
-        result = await session.execute(select(User).where(User.username == username))
-        user = result.scalars().first()
+        user = await principal_from_token(session, token)
         if not user or user.tenant_id != tenant_id:
             await websocket.close(code=1008)
             return
 
-    await ws_manager.connect(websocket, tenant_id)
+    try:
+        since = int(websocket.query_params["since"])
+    except (KeyError, ValueError):
+        since = None
+
+    event_relay.ensure_started()
+    if not await ws_manager.connect(websocket, tenant_id, since=since):
+        return
     try:
         while True:
-            await websocket.receive_text()
+            message = await websocket.receive_text()
+            ws_manager.handle_message(websocket, tenant_id, message)
     except WebSocketDisconnect:
         ws_manager.disconnect(websocket, tenant_id)
 
 
+@app.on_event("startup")
+async def start_event_relay():
+    # Auth invalidations must reach workers that have no websockets yet
+    event_relay.ensure_started()
+
+
+@app.on_event("startup")
+def init_database():
+    init_schema()
+
+
 @app.on_event("startup")
 def create_default_admin():
     username = settings.admin_username
@@ -152,11 +199,36 @@ def create_default_admin():
     db.close()
 
 
+@app.on_event("shutdown")
+async def stop_websockets():
+    await event_relay.stop()
+    await ws_manager.shutdown()
+    await rate_limiter.close()
+
+
 # Role guards
 admin_or_manager = require_role(["admin", "manager"])
 any_user = require_role(["admin", "manager", "user"])
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint(authorization: str | None = Header(None)):
+    """Expose in-process metrics in the Prometheus text format.
+
+    Disabled unless ``METRICS_TOKEN`` is set; scrapers send it as a bearer
+    token.
+    """
+    if not settings.metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metrics.authorized(authorization, settings.metrics_token):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return metrics.registry.render()
+
+
 @app.post("/token")
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
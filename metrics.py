@@ -0,0 +1,286 @@
+"""Low-overhead in-process metrics rendered in the Prometheus text format."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+import bisect
+import functools
+import hmac
+import inspect
+import threading
+import time
+
+LabelValues = Tuple[str, ...]
+# (sample name, label names, label values, value)
+Sample = Tuple[str, Tuple[str, ...], LabelValues, float]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(34), chr(39))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Gauge:
+    """A value sampled when metrics are rendered.
+
+    ``callback`` returns either a number or a mapping of label values to
+    numbers, so gauges cost nothing until they are scraped.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        callback: Callable[[], float | Dict[LabelValues, float]] | None = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def samples(self) -> List[Sample]:
+        values = self._values
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        return [
+            (self.name, self.labelnames, labels, value)
+            for labels, value in values.items()
+        ]
+
+
+class Counter:
+    """A monotonically increasing count, safe to increment from any thread."""
+
+    type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            (self.name, self.labelnames, labels, value)
+            for labels, value in values.items()
+        ]
+
+
+class Histogram:
+    """Cumulative bucketed observations (e.g. latencies in seconds)."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *labels: str) -> int:
+        counts = self._values.get(labels)
+        return int(sum(counts[:-1])) if counts else 0
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        names = self.labelnames + ("le",)
+        result: List[Sample] = []
+        for labels, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                result.append(
+                    (f"{self.name}_bucket", names, labels + (le,), cumulative)
+                )
+            result.append((f"{self.name}_sum", self.labelnames, labels, counts[-1]))
+            result.append((f"{self.name}_count", self.labelnames, labels, cumulative))
+        return result
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Gauge | Counter | Histogram] = {}
+
+    def register(self, metric):
+        # Re-registering (e.g. on module reload) returns the existing metric
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labelnames, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def gauge(
+    name: str,
+    documentation: str,
+    labelnames: Tuple[str, ...] = (),
+    callback: Callable[[], float | Dict[LabelValues, float]] | None = None,
+) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames, callback))
+
+
+def counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Tuple[str, ...] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def timed(metric: Histogram, errors: Counter | None = None):
+    """Decorator observing a function's duration under its name.
+
+    Works for plain and ``async`` functions; exceptions are counted in
+    ``errors`` when given.
+    """
+
+    def decorator(func):
+        name = func.__name__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(name)
+                    raise
+                finally:
+                    metric.observe(time.perf_counter() - start, name)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(name)
+                raise
+            finally:
+                metric.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+def authorized(authorization: str | None, token: str | None) -> bool:
+    """Whether an ``Authorization`` header carries the scrape ``token``."""
+    if not token:
+        return False
+    scheme, _, value = (authorization or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        value.strip().encode(), token.encode()
+    )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    # Set per server by start_http_server
+    token: str | None = None
+
+    def do_GET(self) -> None:
+        if self.token and not authorized(self.headers.get("Authorization"), self.token):
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", "Bearer")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def start_http_server(
+    port: int,
+    host: str = "127.0.0.1",
+    attempts: int = 1,
+    token: str | None = None,
+) -> ThreadingHTTPServer:
+    """Serve ``registry`` on a daemon thread for processes without an API.
+
+    With ``attempts`` > 1 the next ports are tried when ``port`` is taken,
+    so several worker processes on one host each get their own port. With
+    a ``token`` scrapes must send it as a bearer token.
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"token": token})
+    for offset in range(attempts):
+        try:
+            server = ThreadingHTTPServer((host, port + offset), handler)
+            break
+        except OSError:
+            if offset == attempts - 1:
+                raise
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,5 +1,14 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    ForeignKey,
+    DateTime,
+    UniqueConstraint,
+    Index,
+)
+from sqlalchemy import text
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -31,7 +40,7 @@ class Category(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    department_id = Column(Integer, ForeignKey("departments.id"))
+    department_id = Column(Integer, ForeignKey("departments.id"), index=True)
     icon = Column(String, nullable=True)
 
     department = relationship("Department", back_populates="categories")
@@ -57,7 +66,20 @@ class Item(Base):
     department = relationship("Department", back_populates="items")
     category = relationship("Category", back_populates="items")
 
-    __table_args__ = (UniqueConstraint("name", "tenant_id", name="uix_name_tenant"),)
+    __table_args__ = (
+        UniqueConstraint("name", "tenant_id", name="uix_name_tenant"),
+        # Tenant listings and (tenant, name) lookups; the unique constraint
+        # leads with name so it cannot serve tenant-only predicates
+        Index("ix_items_tenant_name", "tenant_id", "name"),
+        # Partial index over the few items below threshold, so the periodic
+        # low stock check does not read every item
+        Index(
+            "ix_items_below_threshold",
+            "tenant_id",
+            sqlite_where=text("available < threshold"),
+            postgresql_where=text("available < threshold"),
+        ),
+    )
 
 
 class User(Base):
@@ -68,9 +90,11 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     role = Column(String, default="user")
-    tenant_id = Column(Integer, ForeignKey("tenants.id"))
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), index=True)
     # "email", "slack" or "none"
     notification_preference = Column(String, default="email")
+    # Incremented to revoke stateless tokens (see auth.bump_token_version)
+    token_version = Column(Integer, default=0, server_default="0")
 
     tenant = relationship("Tenant", back_populates="users")
 
@@ -83,17 +107,19 @@ class AuditLog(Base):
     item_id = Column(Integer, ForeignKey("items.id"))
     action = Column(String)
     quantity = Column(Integer)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     user = relationship("User")
     item = relationship("Item")
 
+    __table_args__ = (Index("ix_audit_logs_item_timestamp", "item_id", "timestamp"),)
+
 
 class Notification(Base):
     __tablename__ = "notifications"
 
     id = Column(Integer, primary_key=True, index=True)
-    item_id = Column(Integer, ForeignKey("items.id"))
+    item_id = Column(Integer, ForeignKey("items.id"), index=True)
     message = Column(String)
     channel = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
@@ -101,12 +127,37 @@ class Notification(Base):
     item = relationship("Item")
 
 
+class NotificationOutbox(Base):
+    """Pending email/Slack deliveries written alongside ``Notification`` rows."""
+
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    notification_id = Column(Integer, ForeignKey("notifications.id"))
+    channel = Column(String)
+    recipient = Column(String, nullable=True)
+    message = Column(String)
+    # "pending", "sent" or "dead"
+    status = Column(String, default="pending")
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    notification = relationship("Notification")
+
+    __table_args__ = (
+        Index("ix_notification_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+
 class PasswordResetToken(Base):
     __tablename__ = "password_reset_tokens"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     token = Column(String, unique=True, index=True)
-    expires_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
 
     user = relationship("User")
@@ -1,16 +1,21 @@
 import smtplib
+from datetime import datetime, timedelta
 from email.message import EmailMessage
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Dict
 import asyncio
 
-from websocket_manager import InventoryWSManager
+from event_bus import publish_event
+from inventory_core import _change_event
 
 import httpx
 from sqlalchemy.orm import Session
 
-from models import Item, Notification, User
+from models import Item, Notification, NotificationOutbox, User
 from config import settings
 
+if TYPE_CHECKING:
+    from websocket_manager import InventoryWSManager
+
 
 def _send_email(message: str, recipient: str | None = None) -> None:
     smtp_server = settings.smtp_server
@@ -23,27 +28,132 @@ def _send_email(message: str, recipient: str | None = None) -> None:
     msg["From"] = sender
     msg["To"] = recipient
     msg.set_content(message)
-    with smtplib.SMTP(smtp_server) as server:
+    timeout = settings.notification_send_timeout
+    with smtplib.SMTP(smtp_server, timeout=timeout) as server:
         server.send_message(msg)
 
 
 def _send_slack(message: str) -> None:
     webhook = settings.slack_webhook_url
     if webhook:
-        httpx.post(webhook, json={"text": message})
+        resp = httpx.post(
+            webhook,
+            json={"text": message},
+            timeout=settings.notification_send_timeout,
+        )
+        resp.raise_for_status()
 
 
-def record_notification(db: Session, item: Item, message: str, channel: str) -> None:
+def record_notification(
+    db: Session,
+    item: Item,
+    message: str,
+    channel: str,
+    recipient: str | None = None,
+) -> None:
+    """Record a notification and queue its delivery in the same transaction."""
     entry = Notification(item_id=item.id, message=message, channel=channel)
     db.add(entry)
+    db.add(
+        NotificationOutbox(
+            notification=entry,
+            channel=channel,
+            recipient=recipient,
+            message=message,
+            status="pending",
+            attempts=0,
+            next_attempt_at=datetime.utcnow(),
+        )
+    )
 
 
-def check_thresholds(
+def _backoff_delay(attempts: int) -> timedelta:
+    delay = settings.outbox_backoff_base * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, settings.outbox_backoff_max))
+
+
+def dispatch_outbox(
     db: Session,
     email_func: Callable[[str, str | None], None] | None = _send_email,
     slack_func: Callable[[str], None] | None = _send_slack,
-    ws_manager: InventoryWSManager | None = None,
+    batch_size: int | None = None,
+    max_attempts: int | None = None,
+) -> Dict[str, int]:
+    """Deliver one batch of due outbox messages.
+
+    Failed sends are retried with exponential backoff; after ``max_attempts``
+    the message is marked ``dead`` and left for inspection.
+    """
+    batch_size = batch_size or settings.outbox_batch_size
+    max_attempts = max_attempts or settings.outbox_max_attempts
+    senders: Dict[str, Callable[[NotificationOutbox], None]] = {}
+    if email_func:
+        senders["email"] = lambda m: email_func(m.message, m.recipient)
+    if slack_func:
+        senders["slack"] = lambda m: slack_func(m.message)
+    counts = {"sent": 0, "retried": 0, "dead": 0}
+    if not senders:
+        return counts
+
+    now = datetime.utcnow()
+    query = (
+        db.query(NotificationOutbox)
+        .filter(
+            NotificationOutbox.status == "pending",
+            NotificationOutbox.next_attempt_at <= now,
+            NotificationOutbox.channel.in_(list(senders)),
+        )
+        .order_by(NotificationOutbox.next_attempt_at, NotificationOutbox.id)
+        .limit(batch_size)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        # Let several dispatchers drain the outbox without double sending
+        query = query.with_for_update(skip_locked=True)
+
+    for message in query.all():
+        message.attempts = (message.attempts or 0) + 1
+        try:
+            senders[message.channel](message)
+        except Exception as exc:
+            message.last_error = str(exc)[:500]
+            if message.attempts >= max_attempts:
+                message.status = "dead"
+                counts["dead"] += 1
+            else:
+                message.next_attempt_at = now + _backoff_delay(message.attempts)
+                counts["retried"] += 1
+        else:
+            message.status = "sent"
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+            counts["sent"] += 1
+    db.commit()
+    return counts
+
+
+def _broadcast_local(
+    ws_manager: "InventoryWSManager", tenant_id: int, payload: dict
+) -> None:
+    try:
+        loop = asyncio.get_running_loop()
+        loop.create_task(ws_manager.broadcast(tenant_id, payload))
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(ws_manager.broadcast(tenant_id, payload))
+        loop.close()
+
+
+def check_thresholds(
+    db: Session,
+    ws_manager: "InventoryWSManager | None" = None,
 ) -> None:
+    """Record low stock notifications and queue their delivery.
+
+    Emails and Slack messages are written to the outbox in the same
+    transaction as the ``Notification`` rows and sent by ``dispatch_outbox``.
+    Websocket events are published through the event bus after the commit,
+    or broadcast directly on ``ws_manager`` when one is given.
+    """
     low_items = (
         db.query(Item).filter(Item.threshold > 0, Item.available < Item.threshold).all()
     )
@@ -51,6 +161,7 @@ def check_thresholds(
         return
 
     users = db.query(User).all()
+    events: list[tuple[int, dict]] = []
     for item in low_items:
         text = (
             f"Item '{item.name}' is below threshold: {item.available} < "
@@ -58,33 +169,21 @@ def check_thresholds(
         )
         if users:
             for u in users:
-                if u.notification_preference == "email" and email_func:
-                    email_func(text, u.username)
-                    record_notification(db, item, text, "email")
-                elif u.notification_preference == "slack" and slack_func:
-                    slack_func(text)
+                if u.notification_preference == "email":
+                    record_notification(db, item, text, "email", u.username)
+                elif u.notification_preference == "slack":
                     record_notification(db, item, text, "slack")
                 elif u.notification_preference == "none":
                     pass
         else:
-            if email_func:
-                email_func(text, None)
-                record_notification(db, item, text, "email")
-            if slack_func:
-                slack_func(text)
-                record_notification(db, item, text, "slack")
-        if ws_manager:
-            payload = {
-                "event": "low_stock",
-                "item": item.name,
-                "available": item.available,
-                "threshold": item.threshold,
-            }
-            try:
-                loop = asyncio.get_running_loop()
-                loop.create_task(ws_manager.broadcast(item.tenant_id, payload))
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                loop.run_until_complete(ws_manager.broadcast(item.tenant_id, payload))
-                loop.close()
+            record_notification(db, item, text, "email")
+            record_notification(db, item, text, "slack")
+        # Same keys as change events so subscription filters apply
+        events.append((item.tenant_id, _change_event(item, "low_stock")))
     db.commit()
+
+    for tenant_id, payload in events:
+        if ws_manager:
+            _broadcast_local(ws_manager, tenant_id, payload)
+        else:
+            publish_event(tenant_id, payload)
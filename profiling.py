@@ -0,0 +1,249 @@
+"""On-demand sampling profiler for single requests.
+
+An admin sends ``X-Profile: 1`` (or ``?_profile=1``) and the request runs
+under ``StackSampler``; the result is written to ``PROFILE_DIR`` in the
+collapsed stack format read by ``flamegraph.pl`` and speedscope, and its id
+is returned in ``X-Profile-Id``. ``PROFILE_SAMPLE_RATE`` profiles that
+fraction of all requests the same way. Without either, the middleware only
+looks at the request headers.
+
+Profile ids carry the tenant of the caller (``<ns>-t<tenant>-...``) so admins
+only see their own tenant's profiles; sampled anonymous requests are stored
+as ``<ns>-anon-...`` and are left to operators with access to the directory.
+"""
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import parse_qs
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from auth import principal_from_token
+from config import settings
+import database_async
+from models import User
+from rate_limiter import _bearer_claims
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_FLAG = "_profile"
+PROFILE_SUFFIX = ".collapsed"
+PROFILE_ID_RE = re.compile(r"^[\w.-]+$")
+PROFILE_TENANT_RE = re.compile(r"^\d+-t(\d+)-")
+
+WORKER_THREAD_NAME = "AnyIO worker thread"
+# Frames of a threadpool worker waiting for its next job
+_IDLE_WORKER_FILES = ("threading.py", "queue.py", os.path.join("anyio", ""))
+
+
+def _frame_name(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def _is_idle(thread: threading.Thread | None, frame) -> bool:
+    if frame.f_code.co_filename.endswith("selectors.py"):
+        # Event loop waiting for I/O
+        return True
+    if thread is None or thread.name != WORKER_THREAD_NAME:
+        return False
+    while frame is not None:
+        if not any(part in frame.f_code.co_filename for part in _IDLE_WORKER_FILES):
+            return False
+        frame = frame.f_back
+    return True
+
+
+class StackSampler:
+    """Sample the stacks of the event loop and threadpool workers.
+
+    Sync endpoints run on threadpool workers, so busy workers are sampled
+    alongside the loop thread; under concurrency the profile also includes
+    whatever other requests those threads are serving.
+    """
+
+    def __init__(self, interval: float, loop_thread: int | None = None) -> None:
+        self.interval = interval
+        self.loop_thread = loop_thread or threading.get_ident()
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def sample(self) -> None:
+        threads: Dict[int, threading.Thread] = {
+            t.ident: t for t in threading.enumerate() if t.ident is not None
+        }
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            if ident != self.loop_thread and (
+                thread is None or thread.name != WORKER_THREAD_NAME
+            ):
+                continue
+            if _is_idle(thread, frame):
+                continue
+            names: List[str] = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile_path(profile_id: str) -> Path | None:
+    """Path of a stored profile, or ``None`` for ids that are not ours."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    return Path(settings.profile_dir) / f"{profile_id}{PROFILE_SUFFIX}"
+
+
+def profile_tenant(profile_id: str) -> int | None:
+    """Tenant recorded in a profile id; ``None`` for anonymous requests."""
+    match = PROFILE_TENANT_RE.match(profile_id)
+    return int(match.group(1)) if match else None
+
+
+def list_profiles(tenant_id: int) -> List[dict]:
+    directory = Path(settings.profile_dir)
+    if not directory.is_dir():
+        return []
+    paths = sorted(directory.glob(f"*-t{tenant_id}-*{PROFILE_SUFFIX}"), reverse=True)
+    profiles = []
+    for path in paths:
+        profile_id = path.name[: -len(PROFILE_SUFFIX)]
+        if profile_tenant(profile_id) == tenant_id:
+            profiles.append({"id": profile_id, "bytes": path.stat().st_size})
+    return profiles
+
+
+def _flagged(scope: Scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == PROFILE_HEADER:
+            return value.strip() not in (b"", b"0")
+    query = scope.get("query_string", b"")
+    if PROFILE_QUERY_FLAG.encode() not in query:
+        return False
+    values = parse_qs(query.decode("latin-1")).get(PROFILE_QUERY_FLAG, ["0"])
+    return values[-1] not in ("", "0")
+
+
+async def _admin(scope: Scope) -> User | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            kind, _, token = value.decode("latin-1").partition(" ")
+            if kind.lower() != "bearer" or not token:
+                return None
+            async with database_async.AsyncSessionLocal() as db:
+                user = await principal_from_token(db, token)
+            return user if user is not None and user.role == "admin" else None
+    return None
+
+
+def _tenant_label(scope: Scope) -> str:
+    claims = _bearer_claims(scope)
+    tenant_id = claims.get("tenant_id") if claims else None
+    return f"t{int(tenant_id)}" if isinstance(tenant_id, int) else "anon"
+
+
+class ProfilingMiddleware:
+    """Profile flagged admin requests and a sampled fraction of the rest."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        sample_rate: float | None = None,
+        interval: float | None = None,
+        directory: str | None = None,
+        max_files: int | None = None,
+    ) -> None:
+        self.app = app
+        self.sample_rate = (
+            settings.profile_sample_rate if sample_rate is None else sample_rate
+        )
+        self.interval = settings.profile_interval if interval is None else interval
+        self.directory = directory
+        self.max_files = settings.profile_max_files if max_files is None else max_files
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        admin = await _admin(scope) if _flagged(scope) else None
+        requested = admin is not None
+        if not requested and not (
+            self.sample_rate > 0 and random.random() < self.sample_rate
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        tenant = f"t{admin.tenant_id}" if requested else _tenant_label(scope)
+        path = re.sub(r"[^\w.-]+", "_", scope["path"].strip("/")) or "root"
+        profile_id = f"{time.time_ns()}-{tenant}-{scope['method']}-{path}"[:120]
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start" and requested:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        sampler = StackSampler(self.interval).start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            stacks = sampler.stop()
+            # Writing and pruning touch the disk; keep them off the event loop
+            await run_in_threadpool(
+                self._store, profile_id, stacks, time.perf_counter() - start, scope
+            )
+
+    def _store(
+        self, profile_id: str, stacks: Counter, duration: float, scope: Scope
+    ) -> None:
+        directory = Path(self.directory or settings.profile_dir)
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            target = directory / f"{profile_id}{PROFILE_SUFFIX}"
+            target.write_text(collapsed(stacks))
+            logger.info(
+                "Profiled %s %s in %.1f ms (%d samples): %s",
+                scope["method"],
+                scope["path"],
+                duration * 1000,
+                sum(stacks.values()),
+                target,
+            )
+            if self.max_files:
+                stored = sorted(directory.glob(f"*{PROFILE_SUFFIX}"))
+                for old in stored[: -self.max_files]:
+                    old.unlink(missing_ok=True)
+        except OSError:
+            logger.exception("Could not store profile %s", profile_id)
@@ -0,0 +1,148 @@
+"""Per-request SQL statement accounting.
+
+Listeners on every ``Engine`` (sync engines and the sync side of async
+engines) time every statement for ``db_statement_duration_seconds`` and
+record it into the ``QueryStats`` of the current request, if any.
+``QueryStatsMiddleware`` starts a fresh ``QueryStats`` for each HTTP request,
+reports the totals in ``X-DB-*`` headers when ``DEBUG`` is on, and logs
+requests over the statement budget or repeating the same statement often
+enough to look like an N+1 pattern.
+"""
+
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Tuple
+import logging
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+statement_duration = metrics.histogram(
+    "db_statement_duration_seconds",
+    "Time spent executing SQL statements",
+    ("statement",),
+)
+
+
+class QueryStats:
+    """Statements issued and time spent in the database for one request."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statements issued at least ``threshold`` times, most frequent first."""
+        return [
+            (statement, n)
+            for statement, n in self.statements.most_common()
+            if n >= threshold
+        ]
+
+
+_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def current_stats() -> QueryStats | None:
+    return _current.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    verb = statement.lstrip()[:6].upper()
+    statement_duration.observe(duration, verb if verb in _VERBS else "OTHER")
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, duration)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context) -> None:
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+class QueryStatsMiddleware:
+    """Count the SQL statements each HTTP request issues."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        debug: bool | None = None,
+        budget: int | None = None,
+        repeat_threshold: int | None = None,
+    ) -> None:
+        self.app = app
+        self.debug = settings.debug if debug is None else debug
+        self.budget = settings.sql_query_budget if budget is None else budget
+        self.repeat_threshold = (
+            settings.sql_repeat_threshold
+            if repeat_threshold is None
+            else repeat_threshold
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.debug:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-db-queries", str(stats.count).encode()),
+                    (b"x-db-time-ms", f"{stats.duration * 1000:.2f}".encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _current.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope: Scope, stats: QueryStats) -> None:
+        request = f"{scope['method']} {scope['path']}"
+        if self.budget and stats.count > self.budget:
+            logger.warning(
+                "%s issued %d SQL statements (budget %d, %.1f ms)",
+                request,
+                stats.count,
+                self.budget,
+                stats.duration * 1000,
+            )
+        if self.repeat_threshold:
+            for statement, n in stats.repeated(self.repeat_threshold):
+                logger.warning(
+                    "Possible N+1 in %s: statement ran %d times: %s",
+                    request,
+                    n,
+                    " ".join(statement.split()),
+                )
@@ -1,55 +1,407 @@
-from typing import Iterable
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import math
+import secrets
 import time
-from collections import defaultdict
+from collections import Counter, OrderedDict
 
 import redis.asyncio as redis
 
-from fastapi import Request
+from jose import JWTError, jwt
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+import metrics
+
+# (allowed, remaining, seconds until the quota resets or, when rejected,
+# until the next request is allowed)
+RateResult = Tuple[bool, int, float]
+
+THROTTLED_PREFIX = "rl:throttled:"
+# Throttled clients remembered per tenant; the least throttled are dropped
+MAX_THROTTLED_TRACKED = 1000
+THROTTLED_TTL = 24 * 3600
+SCAN_BATCH = 500
+
+rate_limit_requests = metrics.counter(
+    "rate_limit_requests_total",
+    "Requests checked against a rate limit policy",
+    ("policy", "result"),
+)
+
+# Sliding window in one atomic round trip. Scores are milliseconds; members
+# carry a random suffix so hits within the same millisecond are all counted.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    count = count + 1
+    allowed = 1
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')[2]
+return {allowed, count, tonumber(oldest or now)}
+"""
+
+
+class MemoryBackend:
+    """In-process GCRA limiter with one float of state per key.
+
+    Each key stores its theoretical arrival time (TAT). Keys are kept in
+    least-recently-used order so every call can cheaply evict a few keys
+    whose TAT has passed (they are indistinguishable from new clients), and
+    the oldest keys are dropped once ``max_keys`` is reached.
+    """
+
+    SWEEP_BATCH = 8
+
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = max_keys
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def allow(
+        self, key: str, limit: int, window: float, now: float | None = None
+    ) -> bool:
+        return self.hit(key, limit, window, now)[0]
+
+    def hit(
+        self, key: str, limit: int, window: float, now: float | None = None
+    ) -> RateResult:
+        now = time.monotonic() if now is None else now
+        self.sweep(now, self.SWEEP_BATCH)
+        interval = window / limit
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        if tat - now > window - interval:
+            return False, 0, tat - now - (window - interval)
+        tat += interval
+        self._tat[key] = tat
+        self._tat.move_to_end(key)
+        while len(self._tat) > self.max_keys:
+            self._tat.popitem(last=False)
+        remaining = int((window - (tat - now)) // interval + 1e-9)
+        return True, max(remaining, 0), tat - now
+
+    def sweep(self, now: float | None = None, batch: int | None = None) -> int:
+        """Evict idle keys from the least recently used end; returns the count."""
+        now = time.monotonic() if now is None else now
+        tats = self._tat
+        evicted = 0
+        while tats and (batch is None or evicted < batch):
+            key, tat = next(iter(tats.items()))
+            if tat > now:
+                break
+            del tats[key]
+            evicted += 1
+        return evicted
+
+    def keys(self) -> List[str]:
+        return list(self._tat)
+
+    def clear(self) -> None:
+        self._tat.clear()
+
+
+SCOPES = ("ip", "user", "tenant")
+
+
+class RatePolicy:
+    """Limit for every path under ``prefix``, counted per ip, user or tenant.
+
+    ``limit``/``window`` default to the limiter's own values when omitted.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        limit: int | None = None,
+        window: int | None = None,
+        scope: str = "ip",
+    ) -> None:
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown rate limit scope {scope!r}")
+        self.prefix = prefix
+        self.limit = limit
+        self.window = window
+        self.scope = scope
+
+    def __repr__(self) -> str:
+        return (
+            f"RatePolicy({self.prefix!r}, {self.limit!r}, {self.window!r}, "
+            f"{self.scope!r})"
+        )
+
+
+def parse_policies(spec: str) -> List[RatePolicy]:
+    """Parse ``"/analytics=30/60:tenant,/items/export=5/60:user,/token"``."""
+    policies = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        scope = "ip"
+        head, sep, tail = entry.rpartition(":")
+        if sep and tail in SCOPES:
+            entry, scope = head, tail
+        prefix, _, rate = entry.partition("=")
+        limit = window = None
+        if rate:
+            count, _, seconds = rate.partition("/")
+            limit = int(count)
+            window = int(seconds) if seconds else None
+        policies.append(RatePolicy(prefix.strip(), limit, window, scope))
+    return policies
+
+
+def _segments(path: str) -> List[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+class _PolicyTrie:
+    """Longest-prefix match of request paths, one path segment per level."""
+
+    def __init__(self) -> None:
+        self._root: Dict = {}
+
+    def add(self, policy: RatePolicy) -> None:
+        node = self._root
+        for segment in _segments(policy.prefix):
+            node = node.setdefault(segment, {})
+        node[None] = policy
+
+    def match(self, path: str) -> Optional[RatePolicy]:
+        node = self._root
+        found = node.get(None)
+        for segment in _segments(path):
+            node = node.get(segment)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
 
 
 class RateLimiter:
-    """Redis backed rate limiter."""
+    """Rate limiter with memory:// (GCRA) and Redis (sliding window) backends."""
 
-    def __init__(self, limit: int, window: int, routes: Iterable[str], redis_url: str):
+    def __init__(
+        self,
+        limit: int,
+        window: int,
+        routes: Iterable[str],
+        redis_url: str,
+        redis_client: redis.Redis | None = None,
+        max_keys: int = 100_000,
+        policies: Iterable[RatePolicy] = (),
+    ):
         self.limit = limit
         self.window = window
         self.routes = list(routes)
+        self.policies = [RatePolicy(route) for route in self.routes] + list(policies)
+        self._trie = _PolicyTrie()
+        for policy in self.policies:
+            self._trie.add(policy)
         self.redis_url = redis_url
-        self._memory_store = defaultdict(list) if redis_url == "memory://" else None
-
-    async def __call__(self, request: Request, call_next):
-        if any(request.url.path.startswith(route) for route in self.routes):
-            key = f"rl:{request.client.host}:{request.url.path}"
-            now = int(time.time())
-            if self._memory_store is not None:
-                queue = [t for t in self._memory_store[key] if t > now - self.window]
-                if len(queue) >= self.limit:
-                    return JSONResponse(
-                        status_code=429,
-                        content={"detail": "Too many requests"},
-                    )
-                queue.append(now)
-                self._memory_store[key] = queue
-            else:
-                async with redis.from_url(self.redis_url, decode_responses=True) as r:
-                    await r.zremrangebyscore(key, 0, now - self.window)
-                    count = await r.zcard(key)
-                    if count >= self.limit:
-                        return JSONResponse(
-                            status_code=429,
-                            content={"detail": "Too many requests"},
-                        )
-                    await r.zadd(key, {str(now): now})
-                    await r.expire(key, self.window)
-        response = await call_next(request)
-        return response
+        self._memory_store = (
+            MemoryBackend(max_keys) if redis_url == "memory://" else None
+        )
+        self._throttled: Dict[int, Counter] = {}
+        self._client = redis_client
+        self._client_loop: asyncio.AbstractEventLoop | None = None
+        self._script = None
+
+    def _redis(self) -> redis.Redis:
+        """Long-lived pooled client, rebuilt if the event loop changes."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or (
+            self._client_loop is not None and self._client_loop is not loop
+        ):
+            self._client = redis.from_url(self.redis_url, decode_responses=True)
+            self._client_loop = loop
+            self._script = None
+        if self._script is None:
+            self._script = self._client.register_script(SLIDING_WINDOW_SCRIPT)
+        return self._client
+
+    def match(self, path: str) -> Optional[RatePolicy]:
+        return self._trie.match(path)
+
+    def limits(self, policy: RatePolicy) -> Tuple[int, int]:
+        return policy.limit or self.limit, policy.window or self.window
+
+    async def allow(self, key: str) -> bool:
+        """Record a hit for ``key`` and return whether it is within the limit."""
+        return (await self.hit(key, self.limit, self.window))[0]
+
+    async def hit(self, key: str, limit: int, window: int) -> RateResult:
+        if self._memory_store is not None:
+            return self._memory_store.hit(key, limit, window)
+        self._redis()
+        now_ms = int(time.time() * 1000)
+        member = f"{now_ms}-{secrets.token_hex(4)}"
+        allowed, count, oldest = await self._script(
+            keys=[key], args=[now_ms, window * 1000, limit, member]
+        )
+        reset = max(int(oldest) + window * 1000 - now_ms, 0) / 1000
+        return bool(allowed), max(limit - int(count), 0), reset
+
+    async def record_throttled(self, tenant_id: int, client: str) -> None:
+        """Count a rejected request from ``client`` against its tenant."""
+        if self._memory_store is not None:
+            counts = self._throttled.setdefault(tenant_id, Counter())
+            counts[client] += 1
+            if len(counts) > MAX_THROTTLED_TRACKED:
+                keep = counts.most_common(MAX_THROTTLED_TRACKED // 2)
+                self._throttled[tenant_id] = Counter(dict(keep))
+            return
+        key = f"{THROTTLED_PREFIX}{tenant_id}"
+        async with self._redis().pipeline(transaction=False) as pipe:
+            pipe.zincrby(key, 1, client)
+            pipe.zremrangebyrank(key, 0, -MAX_THROTTLED_TRACKED - 1)
+            pipe.expire(key, THROTTLED_TTL)
+            await pipe.execute()
+
+    async def top_throttled(self, tenant_id: int, n: int = 10) -> List[Tuple[str, int]]:
+        """Most throttled clients of a tenant, most rejected first."""
+        if self._memory_store is not None:
+            return self._throttled.get(tenant_id, Counter()).most_common(n)
+        rows = await self._redis().zrevrange(
+            f"{THROTTLED_PREFIX}{tenant_id}", 0, n - 1, withscores=True
+        )
+        return [(client, int(score)) for client, score in rows]
+
+    async def scan_keys(
+        self, match: str = "rl:*", batch: int = SCAN_BATCH
+    ) -> AsyncIterator[List[str]]:
+        """Yield limiter keys in batches using incremental SCAN, never KEYS."""
+        if self._memory_store is not None:
+            keys = self._memory_store.keys()
+            for start in range(0, len(keys), batch):
+                yield keys[start : start + batch]
+            return
+        r = self._redis()
+        cursor = 0
+        while True:
+            cursor, keys = await r.scan(cursor, match=match, count=batch)
+            if keys:
+                yield keys
+            if cursor == 0:
+                break
 
     async def reset(self) -> None:
+        self._throttled.clear()
         if self._memory_store is not None:
             self._memory_store.clear()
-        else:
-            async with redis.from_url(self.redis_url, decode_responses=True) as r:
-                keys = await r.keys("rl:*")
-                if keys:
-                    await r.delete(*keys)
+            return
+        r = self._redis()
+        async for keys in self.scan_keys():
+            # UNLINK frees memory in the background instead of blocking Redis
+            await r.unlink(*keys)
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        self._script = None
+        if client is not None and self._client_loop is asyncio.get_running_loop():
+            await client.aclose()
+
+
+def _bearer_claims(scope: Scope) -> Optional[dict]:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            kind, _, token = value.decode("latin-1").partition(" ")
+            if kind.lower() != "bearer" or not token:
+                return None
+            try:
+                return jwt.decode(token, settings.secret_key, algorithms=["HS256"])
+            except JWTError:
+                return None
+    return None
+
+
+def _client_identity(scope: Scope, policy: RatePolicy, claims: Optional[dict]) -> str:
+    """Who a hit is counted against; falls back to the client address.
+
+    Only signed token claims are trusted, never a ``tenant_id`` query
+    parameter, so one tenant cannot exhaust another's quota.
+    """
+    if policy.scope != "ip":
+        if claims:
+            tenant_id = claims.get("tenant_id")
+            if policy.scope == "tenant" and tenant_id is not None:
+                return f"tenant:{tenant_id}"
+            if claims.get("sub"):
+                return f"user:{claims['sub']}"
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware applying a ``RateLimiter``'s policies.
+
+    Paths without a policy are passed straight through. Limited responses
+    carry ``RateLimit-Limit``/``RateLimit-Remaining``/``RateLimit-Reset``
+    headers, and ``Retry-After`` when the request is rejected.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter) -> None:
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        policy = self.limiter.match(path)
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit, window = self.limiter.limits(policy)
+        claims = _bearer_claims(scope) if policy.scope != "ip" else None
+        # One budget per policy, not per URL, so changing a path parameter
+        # does not buy a fresh quota (or a new key)
+        client = f"{_client_identity(scope, policy, claims)}:{policy.prefix}"
+        allowed, remaining, reset = await self.limiter.hit(
+            f"rl:{client}", limit, window
+        )
+        headers = {
+            "RateLimit-Limit": str(limit),
+            "RateLimit-Remaining": str(remaining),
+            "RateLimit-Reset": str(math.ceil(reset)),
+        }
+        rate_limit_requests.inc(policy.prefix, "allowed" if allowed else "rejected")
+        if not allowed:
+            if policy.scope == "ip":
+                claims = _bearer_claims(scope)
+            if claims and claims.get("tenant_id") is not None:
+                await self.limiter.record_throttled(claims["tenant_id"], client)
+            headers["Retry-After"] = headers["RateLimit-Reset"]
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests"},
+                headers=headers,
+            )
+            await response(scope, receive, send)
+            return
+
+        raw_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+        ]
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + raw_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,72 @@
+"""Read-your-writes stickiness for requests served from a read replica.
+
+After a client makes a successful mutating request it gets a short-lived
+cookie; while it is present, ``get_read_db``/``get_async_read_db`` use the
+primary so the client sees its own writes despite replica lag.
+"""
+
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+
+STICKY_COOKIE = "rw_primary"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+prefer_primary: ContextVar[bool] = ContextVar("prefer_primary", default=False)
+
+
+def _sticky_until(scope: Scope) -> float:
+    for name, value in scope.get("headers", ()):
+        if name == b"cookie":
+            cookie = SimpleCookie()
+            try:
+                cookie.load(value.decode("latin-1"))
+            except Exception:
+                return 0.0
+            morsel = cookie.get(STICKY_COOKIE)
+            if morsel is None:
+                return 0.0
+            try:
+                return float(morsel.value)
+            except ValueError:
+                return 0.0
+    return 0.0
+
+
+class ReadYourWritesMiddleware:
+    """Pin a client's reads to the primary for a while after it writes."""
+
+    def __init__(self, app: ASGIApp, seconds: float | None = None) -> None:
+        self.app = app
+        self.seconds = settings.read_your_writes_seconds if seconds is None else seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.seconds <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        token = prefer_primary.set(_sticky_until(scope) > time.time())
+        try:
+            if scope["method"] in SAFE_METHODS:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_cookie(message: Message) -> None:
+                if message["type"] == "http.response.start" and message["status"] < 400:
+                    until = time.time() + self.seconds
+                    cookie = (
+                        f"{STICKY_COOKIE}={until:.3f}; Max-Age={int(self.seconds)}; "
+                        "Path=/; HttpOnly; SameSite=Lax"
+                    )
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"set-cookie", cookie.encode("latin-1"))
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            prefer_primary.reset(token)
@@ -0,0 +1,55 @@
+"""HTTP request latency and status metrics for ``/metrics``."""
+
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+
+request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time spent serving HTTP requests",
+    ("method", "route"),
+)
+requests_total = metrics.counter(
+    "http_requests_total",
+    "HTTP responses sent",
+    ("method", "route", "status"),
+)
+
+
+def _route(scope: Scope) -> str:
+    # FastAPI records the matched route; label by its template so that path
+    # parameters and unknown URLs do not create new series
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """Observe the duration and status of every HTTP request by route."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = _route(scope)
+            request_duration.observe(
+                time.perf_counter() - start, scope["method"], route
+            )
+            requests_total.inc(scope["method"], route, str(status))
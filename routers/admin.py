@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+
+from auth import require_role, ensure_tenant
+from models import User
+from profiling import list_profiles, profile_path, profile_tenant
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+admin_only = require_role(["admin"])
+
+
+@router.get("/rate-limits/throttled")
+async def top_throttled_clients(
+    request: Request,
+    tenant_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    user: User = Depends(admin_only),
+):
+    """Clients of the tenant most often rejected by the rate limiter."""
+    ensure_tenant(user, tenant_id)
+    limiter = request.app.state.rate_limiter
+    rows = await limiter.top_throttled(tenant_id, limit)
+    return [{"client": client, "rejected": count} for client, count in rows]
+
+
+@router.get("/profiles")
+def stored_profiles(user: User = Depends(admin_only)):
+    """The tenant's request profiles in ``PROFILE_DIR``, newest first."""
+    return list_profiles(user.tenant_id)
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str, user: User = Depends(admin_only)):
+    """A stored profile in the collapsed stack format (flamegraph.pl, speedscope)."""
+    path = profile_path(profile_id)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    ensure_tenant(user, profile_tenant(profile_id))
+    return path.read_text()
@@ -6,7 +6,8 @@ from fastapi import (
     HTTPException,
 )
 from inventory_core import get_recent_logs
-from database import SessionLocal, get_db
+import database
+from database import get_read_db
 from sqlalchemy.orm import Session
 from auth import require_role, ensure_tenant
 import csv
@@ -28,7 +29,7 @@ admin_or_manager = require_role(["admin", "manager"])
 def recent_audit_logs(
     tenant_id: int,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: User = Depends(admin_or_manager),
 ):
     ensure_tenant(user, tenant_id)
@@ -90,7 +91,7 @@ def _build_csv(db: Session, limit: int, tenant_id: int) -> str:
 
 
 def _generate_csv(limit: int, tenant_id: int, task_id: str) -> None:
-    db = SessionLocal()
+    db = (database.ReadSessionLocal or database.SessionLocal)()
     try:
         export_tasks[task_id] = _build_csv(db, limit, tenant_id)
     finally:
@@ -105,7 +106,7 @@ def _generate_csv(limit: int, tenant_id: int, task_id: str) -> None:
 def export_audit_csv(
     tenant_id: int,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: User = Depends(admin_or_manager),
 ):
     ensure_tenant(user, tenant_id)
@@ -154,7 +155,7 @@ def get_exported_csv(
 def item_usage(
     item_name: str,
     params: UsageParams = Depends(),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: User = Depends(admin_or_manager),
 ):
     if params.start_date and params.end_date:
@@ -221,7 +222,7 @@ def item_usage(
 )
 def overall_usage(
     params: UsageParams = Depends(),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: User = Depends(admin_or_manager),
 ):
     if params.start_date and params.end_date:
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from auth import require_role, ensure_tenant
-from database import get_db
+from database import get_read_db
 from inventory_core import get_recent_logs
 from models import User
 from schemas import AuditLogResponse
@@ -14,7 +14,7 @@ admin_or_manager = require_role(["admin", "manager"])
 def recent_logs(
     tenant_id: int,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: User = Depends(admin_or_manager),
 ):
     ensure_tenant(user, tenant_id)
@@ -6,7 +6,12 @@ from sqlalchemy.orm import Session
 
 from database import get_db
 from models import User, PasswordResetToken, Tenant
-from auth import get_password_hash
+from auth import (
+    get_password_hash,
+    invalidate_principal,
+    bump_token_version,
+    invalidate_token_version,
+)
 from schemas import (
     PasswordResetRequest,
     PasswordResetConfirm,
@@ -78,6 +83,9 @@ def reset_password(payload: PasswordResetConfirm, db: Session = Depends(get_db))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user.hashed_password = get_password_hash(payload.new_password)
+    bump_token_version(user)
     db.delete(entry)
     db.commit()
+    invalidate_principal(user.username)
+    invalidate_token_version(user.id)
     return {"detail": "Password updated"}
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import Dict
-from database import get_db
+from database import get_db, get_read_db
 from auth import get_current_user
 from models import User
 from schemas import (
@@ -53,7 +53,7 @@ def api_add_item(
 def api_status(
     name: str | None = None,
     tenant_id: int = 1,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     items: Dict[str, dict] = get_status(db, tenant_id=tenant_id, name=name)
@@ -128,7 +128,7 @@ def api_transfer_item(
 def api_item_history(
     name: str,
     tenant_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     logs = get_item_history(db, name=name, tenant_id=tenant_id)
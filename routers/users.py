@@ -1,10 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from config import settings
 from database import get_db
 from models import User
-from schemas import UserCreate, UserResponse, UserUpdate, UserDelete
-from auth import require_role, get_password_hash, ensure_tenant
+from schemas import (
+    UserCreate,
+    UserResponse,
+    UserUpdate,
+    UserDelete,
+    UserBulkCreate,
+    UserBulkError,
+    UserBulkResult,
+)
+from auth import (
+    require_role,
+    get_password_hash,
+    get_password_hashes,
+    ensure_tenant,
+    invalidate_principal,
+    bump_token_version,
+    invalidate_token_version,
+)
 
 router = APIRouter()
 
@@ -41,6 +60,72 @@ def create_user(
     return new_user
 
 
+@router.post("/users/bulk", response_model=UserBulkResult)
+def bulk_create_users(
+    payload: UserBulkCreate,
+    db: Session = Depends(get_db),
+    user: User = Depends(admin_only),
+):
+    """Create many users at once; rows that clash are reported, not created."""
+    ensure_tenant(user, payload.tenant_id)
+    if len(payload.users) > settings.user_import_max_rows:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.user_import_max_rows} users per import",
+        )
+
+    # Usernames and emails are unique across tenants, so check globally
+    usernames = {row.username for row in payload.users}
+    emails = {row.email for row in payload.users}
+    existing = db.query(User.username, User.email).filter(
+        or_(User.username.in_(usernames), User.email.in_(emails))
+    )
+    taken_usernames = set()
+    taken_emails = set()
+    for username, email in existing:
+        taken_usernames.add(username)
+        taken_emails.add(email)
+
+    errors: list[UserBulkError] = []
+    accepted = []
+    for index, row in enumerate(payload.users):
+        if row.username in taken_usernames:
+            detail = "Username already registered"
+        elif row.email in taken_emails:
+            detail = "Email already registered"
+        else:
+            taken_usernames.add(row.username)
+            taken_emails.add(row.email)
+            accepted.append(row)
+            continue
+        errors.append(UserBulkError(index=index, username=row.username, detail=detail))
+
+    hashes = get_password_hashes(row.password for row in accepted)
+    new_users = [
+        User(
+            username=row.username,
+            email=row.email,
+            hashed_password=hashed,
+            role=row.role,
+            tenant_id=payload.tenant_id,
+            notification_preference=row.notification_preference,
+        )
+        for row, hashed in zip(accepted, hashes)
+    ]
+    db.add_all(new_users)
+    # The response only needs the values we just inserted; keeping them
+    # loaded avoids reading every new row back after the commit
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=409, detail="Users were created concurrently, retry"
+        )
+    return {"created": new_users, "errors": errors}
+
+
 @router.get("/users/", response_model=list[UserResponse])
 def list_users(
     tenant_id: int,
@@ -64,6 +149,7 @@ def update_user(
     )
     if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
+    previous_username = user_obj.username
     if payload.username:
         if (
             db.query(User)
@@ -83,8 +169,12 @@ def update_user(
         user_obj.role = payload.role
     if payload.notification_preference:
         user_obj.notification_preference = payload.notification_preference
+    if payload.username or payload.password or payload.role:
+        bump_token_version(user_obj)
     db.commit()
     db.refresh(user_obj)
+    invalidate_principal(previous_username, user_obj.username)
+    invalidate_token_version(user_obj.id)
     return user_obj
 
 
@@ -101,6 +191,9 @@ def delete_user(
     )
     if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
+    username = user_obj.username
     db.delete(user_obj)
     db.commit()
+    invalidate_principal(username)
+    invalidate_token_version(payload.id)
     return {"detail": "User deleted"}
@@ -89,6 +89,27 @@ class UserResponse(UserBase):
         model_config = ConfigDict(from_attributes=True)
 
 
+class UserImportRow(UserBase):
+    password: str
+    role: str = "user"
+
+
+class UserBulkCreate(BaseModel):
+    tenant_id: int
+    users: list[UserImportRow]
+
+
+class UserBulkError(BaseModel):
+    index: int
+    username: str
+    detail: str
+
+
+class UserBulkResult(BaseModel):
+    created: list[UserResponse]
+    errors: list[UserBulkError]
+
+
 class UserUpdate(BaseModel):
     id: int
     username: str | None = None
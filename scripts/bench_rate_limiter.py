@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""Benchmark the memory:// rate limiter backend with many distinct clients."""
+
+import argparse
+import time
+import tracemalloc
+
+from rate_limiter import MemoryBackend
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark MemoryBackend")
+    parser.add_argument(
+        "--clients", type=int, default=1_000_000, help="Distinct client keys"
+    )
+    parser.add_argument(
+        "--max-keys", type=int, default=100_000, help="MemoryBackend max_keys"
+    )
+    parser.add_argument("--limit", type=int, default=5, help="Requests per window")
+    parser.add_argument("--window", type=float, default=60, help="Window in seconds")
+    args = parser.parse_args()
+
+    backend = MemoryBackend(args.max_keys)
+    keys = [
+        f"rl:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:/token"
+        for i in range(args.clients)
+    ]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for key in keys:
+        backend.allow(key, args.limit, args.window)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rate = args.clients / elapsed
+    print(f"{args.clients} clients in {elapsed:.2f}s -> {rate:,.0f} checks/s")
+    print(f"keys kept: {len(backend)} (max {args.max_keys})")
+    print(f"peak limiter memory: {peak / 1024 / 1024:.1f} MiB")
+
+    evicted = backend.sweep(time.monotonic() + args.window)
+    print(f"idle keys evicted after one window: {evicted}")
+
+
+if __name__ == "__main__":
+    main()
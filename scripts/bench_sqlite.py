@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Compare concurrent SQLite throughput with and without the tuned profile.
+
+Three runs: SQLAlchemy defaults, the profile PRAGMAs alone, and the PRAGMAs
+plus ``SerializedWriteSession`` queuing writers behind one lock.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from sqlite_profile import SerializedWriteSession, apply_sqlite_profile
+
+
+RUNS = (
+    ("default", False, False),
+    ("pragmas", True, False),
+    ("pragmas+serialized", True, True),
+)
+
+
+async def run(
+    path: str,
+    label: str,
+    pragmas: bool,
+    serialized: bool,
+    writers: int,
+    readers: int,
+    ops: int,
+) -> None:
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 5}
+    )
+    if pragmas:
+        apply_sqlite_profile(engine.sync_engine)
+    sessions = async_sessionmaker(
+        engine,
+        expire_on_commit=False,
+        sync_session_class=SerializedWriteSession if serialized else Session,
+    )
+    async with engine.begin() as conn:
+        await conn.execute(
+            text("CREATE TABLE IF NOT EXISTS bench (id INTEGER PRIMARY KEY, v TEXT)")
+        )
+
+    errors = 0
+    reads = 0
+
+    async def writer(n: int) -> None:
+        nonlocal errors
+        for i in range(ops):
+            try:
+                async with sessions() as session:
+                    await session.execute(
+                        text("INSERT INTO bench (v) VALUES (:v)"), {"v": f"{n}-{i}"}
+                    )
+                    await session.commit()
+            except OperationalError:
+                errors += 1
+
+    async def reader(stop: asyncio.Event) -> None:
+        nonlocal errors, reads
+        while not stop.is_set():
+            try:
+                async with sessions() as session:
+                    await session.execute(text("SELECT count(*) FROM bench"))
+                reads += 1
+            except OperationalError:
+                errors += 1
+            await asyncio.sleep(0)
+
+    stop = asyncio.Event()
+    reader_tasks = [asyncio.create_task(reader(stop)) for _ in range(readers)]
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*reader_tasks)
+    await engine.dispose()
+
+    print(
+        f"{label:<18}: {writers * ops / elapsed:8.1f} writes/s "
+        f"{reads / elapsed:8.1f} reads/s  errors={errors}  ({elapsed:.2f}s)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite profile")
+    parser.add_argument("--writers", type=int, default=16, help="Writer coroutines")
+    parser.add_argument("--readers", type=int, default=4, help="Reader coroutines")
+    parser.add_argument("--ops", type=int, default=100, help="Writes per writer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, pragmas, serialized in RUNS:
+            path = os.path.join(tmp, f"bench-{label}.db")
+            asyncio.run(
+                run(
+                    path,
+                    label,
+                    pragmas,
+                    serialized,
+                    args.writers,
+                    args.readers,
+                    args.ops,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Connection tuning and write serialization for SQLite deployments.
+
+SQLite allows one writer at a time. WAL lets readers proceed alongside that
+writer, the busy timeout makes contending connections wait instead of failing
+with "database is locked", and serializing async writers inside the process
+avoids pointless lock contention between coroutines.
+"""
+
+from typing import Dict
+import asyncio
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.util import await_only
+
+from config import settings
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def profile_pragmas() -> Dict[str, object]:
+    return {
+        "journal_mode": settings.sqlite_journal_mode,
+        "synchronous": settings.sqlite_synchronous,
+        "busy_timeout": settings.sqlite_busy_timeout_ms,
+        "mmap_size": settings.sqlite_mmap_size,
+        "cache_size": settings.sqlite_cache_size,
+    }
+
+
+def apply_sqlite_profile(engine: Engine) -> None:
+    """Run the profile PRAGMAs on every new DBAPI connection of ``engine``.
+
+    Pass ``async_engine.sync_engine`` for async engines.
+    """
+    pragmas = profile_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+_write_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]"
+_write_locks = weakref.WeakKeyDictionary()
+
+
+def _write_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    return lock
+
+
+class SerializedWriteSession(Session):
+    """Sync session class for ``AsyncSession`` that queues writers.
+
+    The first flush or non-SELECT statement of a transaction (ORM or
+    textual) waits for the event loop's write lock, which is held until the
+    transaction ends (commit, rollback or close). Only one coroutine per
+    process writes at a time; reads never wait.
+    """
+
+
+# Leading keywords of textual statements that never write
+_READ_ONLY_VERBS = {"SELECT", "EXPLAIN", "VALUES"}
+
+
+def _is_write(statement) -> bool:
+    if isinstance(statement, TextClause):
+        words = statement.text.lstrip().split(None, 1)
+        return bool(words) and words[0].upper() not in _READ_ONLY_VERBS
+    return not getattr(statement, "is_select", False)
+
+
+def _acquire(session: Session) -> None:
+    if "sqlite_write_lock" not in session.info:
+        lock = _write_lock()
+        await_only(lock.acquire())
+        session.info["sqlite_write_lock"] = lock
+
+
+@event.listens_for(SerializedWriteSession, "before_flush")
+def _lock_before_flush(session, flush_context, instances):
+    _acquire(session)
+
+
+@event.listens_for(SerializedWriteSession, "do_orm_execute")
+def _lock_before_dml(orm_execute_state):
+    if _is_write(orm_execute_state.statement):
+        _acquire(orm_execute_state.session)
+
+
+@event.listens_for(SerializedWriteSession, "after_transaction_end")
+def _unlock_after_transaction(session, transaction):
+    if transaction.parent is None:
+        lock = session.info.pop("sqlite_write_lock", None)
+        if lock is not None:
+            lock.release()
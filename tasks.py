@@ -1,8 +1,23 @@
+from contextvars import Token
+from typing import Dict, Tuple
+import os
+import time
+
 from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_process_init,
+    worker_ready,
+)
 from database import SessionLocal
-from notifications import check_thresholds
+from notifications import check_thresholds, dispatch_outbox
 
 from config import settings
+import metrics
+import query_stats  # noqa: F401 - times SQL statements for /metrics
+import tracing
 
 broker_url = settings.celery_broker_url
 celery_app = Celery("stock_saas", broker=broker_url)
@@ -11,9 +26,93 @@ celery_app.conf.beat_schedule = {
     "check-stock-levels": {
         "task": "tasks.check_stock_levels",
         "schedule": settings.stock_check_interval,
-    }
+    },
+    "dispatch-notifications": {
+        "task": "tasks.dispatch_notifications",
+        "schedule": settings.outbox_dispatch_interval,
+    },
+}
+
+# Deliveries run on their own queue so slow SMTP/Slack calls never hold up
+# the threshold scan. Start a worker with ``-Q notifications`` to drain it.
+celery_app.conf.task_routes = {
+    "tasks.dispatch_notifications": {"queue": "notifications"},
 }
 
+# Upper bound on batches drained by a single dispatch run
+MAX_DISPATCH_BATCHES = 10
+
+# Ports tried after WORKER_METRICS_PORT so each pool process gets its own
+METRICS_PORT_ATTEMPTS = 32
+
+task_duration = metrics.histogram(
+    "celery_task_duration_seconds",
+    "Time spent running Celery tasks",
+    ("task", "state"),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+_task_started: Dict[str, float] = {}
+# task id -> (span, context token, whether the span is the local root)
+_task_spans: Dict[str, Tuple[tracing.Span, Token, bool]] = {}
+# pid of the process already serving metrics; forked children start their own
+_metrics_pid: int | None = None
+
+
+@before_task_publish.connect
+def _inject_traceparent(headers=None, **kwargs) -> None:
+    """Carry the enqueuing span's trace into the task's message headers."""
+    span = tracing.current_span()
+    if span is not None and headers is not None:
+        headers["traceparent"] = span.traceparent()
+
+
+@task_prerun.connect
+def _task_prerun(task_id=None, task=None, **kwargs) -> None:
+    _task_started[task_id] = time.perf_counter()
+    local_root = tracing.current_span() is None
+    span = tracing.start_span(
+        f"celery {task.name}",
+        tracing.SPAN_KIND_CONSUMER,
+        root=True,
+        traceparent=task.request.get("traceparent"),
+        **{"celery.task_id": task_id},
+    )
+    if span is not None:
+        _task_spans[task_id] = (span, tracing.activate(span), local_root)
+
+
+@task_postrun.connect
+def _task_postrun(task_id=None, task=None, state=None, **kwargs) -> None:
+    start = _task_started.pop(task_id, None)
+    if start is not None:
+        task_duration.observe(
+            time.perf_counter() - start, task.name, state or "UNKNOWN"
+        )
+    entry = _task_spans.pop(task_id, None)
+    if entry is not None:
+        span, token, local_root = entry
+        tracing.deactivate(token)
+        span.set_attribute("celery.state", state or "UNKNOWN")
+        if state == "FAILURE":
+            span.status = tracing.STATUS_ERROR
+        tracing.finish_span(span, local_root)
+
+
+@worker_process_init.connect
+@worker_ready.connect
+def start_metrics_server(**kwargs) -> None:
+    """Expose this worker process's metrics on ``WORKER_METRICS_PORT``."""
+    global _metrics_pid
+    if settings.worker_metrics_port is None or _metrics_pid == os.getpid():
+        return
+    metrics.start_http_server(
+        settings.worker_metrics_port,
+        host=settings.worker_metrics_host,
+        attempts=METRICS_PORT_ATTEMPTS,
+        token=settings.metrics_token,
+    )
+    _metrics_pid = os.getpid()
+
 
 @celery_app.task
 def check_stock_levels():
@@ -22,3 +121,15 @@ def check_stock_levels():
         check_thresholds(db)
     finally:
         db.close()
+
+
+@celery_app.task
+def dispatch_notifications():
+    db = SessionLocal()
+    try:
+        for _ in range(MAX_DISPATCH_BATCHES):
+            counts = dispatch_outbox(db)
+            if sum(counts.values()) < settings.outbox_batch_size:
+                break
+    finally:
+        db.close()
@@ -7,6 +7,8 @@ import httpx
 import inspect
 
 os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("METRICS_TOKEN", "test-metrics")
+METRICS_HEADERS = {"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"}
 
 from sqlalchemy import create_engine  # noqa: E402
 from sqlalchemy.orm import sessionmaker  # noqa: E402
@@ -15,6 +17,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # no
 import database  # noqa: E402
 import database_async  # noqa: E402
 import main  # noqa: E402
+import auth  # noqa: E402
 from models import User, Tenant  # noqa: E402
 from auth import get_password_hash  # noqa: E402
 
@@ -45,6 +48,7 @@ def client():
     database_async.async_engine = async_engine
     database_async.AsyncSessionLocal = TestingAsyncSessionLocal
     main.app.router.on_startup.clear()
+    auth.clear_principal_cache()
 
     database.Base.metadata.create_all(bind=engine)
 
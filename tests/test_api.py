@@ -1,4 +1,4 @@
-from tests.conftest import get_token
+from tests.conftest import METRICS_HEADERS, get_token
 
 
 def test_multi_tenant_isolation(client):
@@ -289,3 +289,191 @@ def test_register_missing_tenant(client):
         },
     )
     assert resp.status_code == 404
+
+
+def test_metrics_endpoint_exposes_websocket_gauges(client):
+    resp = client.get("/metrics", headers=METRICS_HEADERS)
+    assert resp.status_code == 200
+    assert "# TYPE ws_connections gauge" in resp.text
+
+
+def test_metrics_endpoint_requires_the_scrape_token(client, monkeypatch):
+    from config import settings
+
+    assert client.get("/metrics").status_code == 401
+    bad = {"Authorization": "Bearer wrong"}
+    assert client.get("/metrics", headers=bad).status_code == 401
+    monkeypatch.setattr(settings, "metrics_token", None)
+    assert client.get("/metrics", headers=METRICS_HEADERS).status_code == 404
+
+
+def test_authenticated_requests_reuse_cached_principal(client, monkeypatch):
+    import auth
+
+    token = get_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/users/?tenant_id=1", headers=headers).status_code == 200
+
+    lookups = []
+    original = auth.select
+
+    def counting_select(*args, **kwargs):
+        lookups.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(auth, "select", counting_select)
+    for _ in range(3):
+        assert client.get("/users/?tenant_id=1", headers=headers).status_code == 200
+    assert lookups == []
+
+
+def test_user_update_invalidates_cached_principal(client, monkeypatch):
+    import main
+
+    # /users/* shares one rate limit budget; this test needs six calls
+    monkeypatch.setattr(main.app.state.rate_limiter, "limit", 100)
+    token = get_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = client.post(
+        "/users/",
+        json={
+            "username": "demoted",
+            "email": "demoted@example.com",
+            "password": "pw",
+            "role": "admin",
+            "tenant_id": 1,
+        },
+        headers=headers,
+    )
+    assert resp.status_code == 200
+    user_id = resp.json()["id"]
+    login = client.post(
+        "/token",
+        data={"username": "demoted", "password": "pw"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    demoted_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    assert client.get("/users/?tenant_id=1", headers=demoted_headers).status_code == 200
+
+    resp = client.put(
+        "/users/update", json={"id": user_id, "role": "user"}, headers=headers
+    )
+    assert resp.status_code == 200
+    assert client.get("/users/?tenant_id=1", headers=demoted_headers).status_code == 403
+
+    resp = client.request(
+        "DELETE", "/users/delete", json={"id": user_id}, headers=headers
+    )
+    assert resp.status_code == 200
+    assert client.get("/users/?tenant_id=1", headers=demoted_headers).status_code == 401
+
+
+def test_stateless_tokens_skip_user_lookup_and_are_revoked(client, monkeypatch):
+    import auth
+    from config import settings
+
+    monkeypatch.setattr(settings, "stateless_auth", True)
+    token = get_token(client)
+    claims = auth.jwt.get_unverified_claims(token)
+    assert claims["tenant_id"] == 1 and claims["role"] == "admin"
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/users/?tenant_id=1", headers=headers).status_code == 200
+
+    resolved = []
+    monkeypatch.setattr(auth, "resolve_principal", lambda *args: resolved.append(args))
+    for _ in range(3):
+        # 404 rather than 401: authenticated, but tenant 1 has no items yet
+        assert client.get("/items/status", headers=headers).status_code == 404
+    assert resolved == []
+
+    resp = client.put(
+        "/users/update",
+        json={"id": claims["uid"], "password": "admin"},
+        headers=headers,
+    )
+    assert resp.status_code == 200
+    assert client.get("/items/status", headers=headers).status_code == 401
+    fresh = {"Authorization": f"Bearer {get_token(client)}"}
+    assert client.get("/items/status", headers=fresh).status_code == 404
+
+
+def test_password_hasher_sheds_load_when_saturated(client, monkeypatch):
+    import threading
+    import auth
+
+    hasher = auth.PasswordHasher(workers=1, max_pending=1)
+    monkeypatch.setattr(auth, "password_hasher", hasher)
+    release = threading.Event()
+    blocked = hasher.submit(release.wait)
+    assert hasher.pending == 1
+
+    resp = client.post(
+        "/token",
+        data={"username": "admin", "password": "admin"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+
+    release.set()
+    blocked.result(timeout=5)
+    assert hasher.pending == 0 and hasher.in_flight == 0
+    assert get_token(client)
+    assert (
+        "password_hash_queue_depth 0"
+        in client.get("/metrics", headers=METRICS_HEADERS).text
+    )
+
+
+def test_bulk_user_import_reports_row_errors(client):
+    from sqlalchemy import event
+
+    import database
+
+    token = get_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    rows = [
+        {"username": f"bulk{i}", "email": f"bulk{i}@example.com", "password": "pw"}
+        for i in range(5)
+    ]
+    rows.append({"username": "admin", "email": "new@example.com", "password": "pw"})
+    rows.append({"username": "bulk0", "email": "other@example.com", "password": "x"})
+    rows.append({"username": "bulk9", "email": "bulk1@example.com", "password": "x"})
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, many):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        resp = client.post(
+            "/users/bulk", json={"tenant_id": 1, "users": rows}, headers=headers
+        )
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [u["username"] for u in body["created"]] == [f"bulk{i}" for i in range(5)]
+    assert len({u["id"] for u in body["created"]}) == 5
+    # Created rows are not read back one by one
+    assert not any(
+        s.lstrip().startswith("SELECT") and "users.id = " in s for s in statements
+    )
+    assert all(u["tenant_id"] == 1 and u["role"] == "user" for u in body["created"])
+    assert [(e["index"], e["detail"]) for e in body["errors"]] == [
+        (5, "Username already registered"),
+        (6, "Username already registered"),
+        (7, "Email already registered"),
+    ]
+
+    login = client.post(
+        "/token",
+        data={"username": "bulk3", "password": "pw"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert login.status_code == 200
+
+    resp = client.post(
+        "/users/bulk", json={"tenant_id": 2, "users": rows[:1]}, headers=headers
+    )
+    assert resp.status_code == 403
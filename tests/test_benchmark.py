@@ -0,0 +1,47 @@
+import asyncio
+
+import httpx
+import pytest
+
+import benchmark
+
+
+def test_parse_mix_and_percentiles():
+    assert benchmark.parse_mix("status=3, add=1") == {"status": 3.0, "add": 1.0}
+    with pytest.raises(ValueError):
+        benchmark.parse_mix("bogus=1")
+    values = [i / 1000 for i in range(1, 101)]
+    assert benchmark.percentile(values, 50) == 0.05
+    assert benchmark.percentile(values, 99) == 0.099
+    assert benchmark.percentile([], 95) == 0.0
+
+
+def test_load_run_reports_every_endpoint(client):
+    import main
+
+    async def run(**kwargs):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as http:
+            return await benchmark.run_load(
+                http, tenants=1, users=1, items=2, seed=1, **kwargs
+            )
+
+    loop = asyncio.get_event_loop()
+    closed = loop.run_until_complete(run(duration=0.5, concurrency=2, prefix="c"))
+    assert closed["config"]["mode"] == "closed"
+    assert set(closed["endpoints"]) == set(benchmark.OPERATIONS)
+    assert closed["total"]["count"] > 0
+    assert closed["total"]["errors"] == 0
+    summary = closed["endpoints"]["status"]
+    assert summary["p50_ms"] <= summary["p95_ms"] <= summary["p99_ms"]
+    assert summary["p99_ms"] <= summary["max_ms"]
+    assert sum(summary["histogram_ms"].values()) == summary["count"]
+
+    opened = loop.run_until_complete(
+        run(duration=0.3, rate=50, mix="status=1", prefix="o")
+    )
+    assert opened["config"]["mode"] == "open"
+    assert list(opened["endpoints"]) == ["status"]
+    assert opened["total"]["count"] > 0
@@ -0,0 +1,40 @@
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import QueuePool
+
+import db_pool
+import metrics
+
+
+def test_instrumented_pool_records_waits_overflow_and_timeouts(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=db_pool.instrumented_pool(QueuePool, "test"),
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.05,
+    )
+    first = engine.connect()
+    second = engine.connect()
+    assert db_pool.overflow_checkouts.value("test") == 1
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    assert db_pool.checkout_timeouts.value("test") == 1
+    assert db_pool.checkout_wait.count("test") == 3
+
+    rendered = metrics.registry.render()
+    assert 'db_pool_connections_in_use{engine="test"} 2' in rendered
+    assert 'db_pool_overflow{engine="test"} 1' in rendered
+    assert 'db_pool_checkout_wait_seconds_bucket{engine="test",le="+Inf"} 3' in rendered
+    second.close()
+    first.close()
+    engine.dispose()
+
+
+def test_engine_options_come_from_settings(monkeypatch):
+    monkeypatch.setattr(db_pool.settings, "db_pool_size", 7)
+    options = db_pool.engine_options("postgresql://db/app", "replica")
+    assert options["pool_size"] == 7
+    assert options["pool_pre_ping"] is True
+    assert options["poolclass"].engine_label == "replica"
+    assert db_pool.engine_options("sqlite://", "memory") == {}
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from event_bus import (
+    AUTH_CHANNEL,
+    EventCoalescer,
+    EventRelay,
+    InMemoryBroker,
+    RedisBroker,
+    publish_auth_invalidation,
+    publish_event,
+    tenant_channel,
+)
+from websocket_manager import InventoryWSManager
+
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def _wait_for(predicate, timeout: float = 1.0) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_relay_forwards_events_to_local_tenant_sockets():
+    broker = InMemoryBroker()
+    manager = InventoryWSManager()
+    relay = EventRelay(manager, broker)
+    relay.ensure_started()
+    await asyncio.sleep(0)
+
+    ws1, ws2 = FakeSocket(), FakeSocket()
+    await manager.connect(ws1, 1)
+    await manager.connect(ws2, 2)
+
+    publish_event(1, {"event": "low_stock", "item": "paper"}, broker=broker)
+    await _wait_for(lambda: ws1.sent)
+
+    assert [json.loads(m)["item"] for m in ws1.sent] == ["paper"]
+    assert ws2.sent == []
+    await relay.stop()
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_events_published_from_other_threads_are_relayed():
+    """Celery tasks and sync routes publish from outside the event loop."""
+    broker = InMemoryBroker()
+    managers = [InventoryWSManager(), InventoryWSManager()]
+    relays = [EventRelay(m, broker) for m in managers]
+    for relay in relays:
+        relay.ensure_started()
+    await asyncio.sleep(0)
+
+    sockets = [FakeSocket(), FakeSocket()]
+    for manager, ws in zip(managers, sockets):
+        await manager.connect(ws, 3)
+
+    thread = threading.Thread(
+        target=lambda: publish_event(3, {"event": "update"}, broker=broker)
+    )
+    thread.start()
+    thread.join()
+    await _wait_for(lambda: all(ws.sent for ws in sockets))
+
+    # Every worker's relay delivers to its own sockets
+    assert all(len(ws.sent) == 1 for ws in sockets)
+    for relay, manager in zip(relays, managers):
+        await relay.stop()
+        await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_relay_ignores_foreign_channels():
+    broker = InMemoryBroker()
+    manager = InventoryWSManager()
+    relay = EventRelay(manager, broker)
+    relay.ensure_started()
+    await asyncio.sleep(0)
+    ws = FakeSocket()
+    await manager.connect(ws, 1)
+
+    broker.publish("other:1", "{}")
+    broker.publish(tenant_channel("x"), "{}")
+    await asyncio.sleep(0.05)
+
+    assert ws.sent == []
+    await relay.stop()
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_workers_share_publish_time_seq_for_resume():
+    """A client can resume on a different worker than the one it left."""
+    broker = InMemoryBroker()
+    managers = [InventoryWSManager(), InventoryWSManager()]
+    relays = [EventRelay(m, broker) for m in managers]
+    for relay in relays:
+        relay.ensure_started()
+    await asyncio.sleep(0)
+    sockets = [FakeSocket(), FakeSocket()]
+    for manager, ws in zip(managers, sockets):
+        await manager.connect(ws, 1)
+
+    for n in range(3):
+        publish_event(1, {"event": "update", "n": n}, broker=broker)
+    await _wait_for(lambda: all(len(ws.sent) == 3 for ws in sockets))
+    for ws in sockets:
+        assert [json.loads(m)["seq"] for m in ws.sent] == [1, 2, 3]
+
+    # Seen seq 1 on the first worker, reconnects to the second
+    resumed = FakeSocket()
+    await managers[1].connect(resumed, 1, since=1)
+    await _wait_for(lambda: len(resumed.sent) == 2)
+    assert [json.loads(m)["n"] for m in resumed.sent] == [1, 2]
+    for relay, manager in zip(relays, managers):
+        await relay.stop()
+        await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_missed_published_seq_requires_resync():
+    manager = InventoryWSManager()
+    dropped = FakeSocket()
+    await manager.connect(dropped, 1)
+    manager.disconnect(dropped, 1)
+    for seq in (1, 2, 4):
+        manager.broadcast_text(1, json.dumps({"seq": seq, "event": "update"}))
+
+    ws = FakeSocket()
+    await manager.connect(ws, 1, since=2)
+    await _wait_for(lambda: ws.sent)
+    assert json.loads(ws.sent[0]) == {"event": "resync_required", "seq": 4}
+    current = FakeSocket()
+    await manager.connect(current, 1, since=4)
+    await asyncio.sleep(0.05)
+    assert current.sent == []
+    await manager.shutdown()
+
+
+def test_redis_broker_seq_is_shared_per_tenant():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    brokers = [RedisBroker("redis://unused"), RedisBroker("redis://unused")]
+    for broker in brokers:
+        broker._client = fakeredis.FakeRedis(server=server)
+
+    assert [brokers[0].next_seq(1), brokers[1].next_seq(1)] == [1, 2]
+    assert brokers[1].next_seq(2) == 1
+
+
+@pytest.mark.asyncio
+async def test_relay_applies_auth_invalidations_from_other_workers():
+    import auth
+    from models import User
+
+    broker = InMemoryBroker()
+    manager = InventoryWSManager()
+    relay = EventRelay(
+        manager, broker, on_auth_invalidation=auth.apply_auth_invalidation
+    )
+    relay.ensure_started()
+    await asyncio.sleep(0)
+    auth._principal_cache["demoted"] = (float("inf"), User(username="demoted"))
+    auth._version_cache[5] = (float("inf"), 1)
+
+    publish_auth_invalidation({"usernames": ["demoted"]}, broker=broker)
+    publish_auth_invalidation({"user_ids": [5]}, broker=broker)
+    broker.publish(AUTH_CHANNEL, "not json")
+    await _wait_for(lambda: 5 not in auth._version_cache)
+
+    assert "demoted" not in auth._principal_cache
+    assert 5 not in auth._version_cache
+    await relay.stop()
+    await manager.shutdown()
+
+
+def test_invalidating_a_principal_notifies_other_workers(monkeypatch):
+    import auth
+
+    published = []
+    monkeypatch.setattr(auth, "publish_auth_invalidation", published.append)
+    auth.invalidate_principal("old", None, "new")
+    auth.invalidate_token_version(None)
+    auth.invalidate_token_version(7)
+    assert published == [{"usernames": ["old", "new"]}, {"user_ids": [7]}]
+
+
+def test_coalescer_keeps_latest_event_per_item():
+    published = []
+    coalescer = EventCoalescer(
+        window=60, publish=lambda tid, data: published.append((tid, data))
+    )
+    for qty in range(200):
+        coalescer.add(1, 10, {"item": "scanner", "available": qty})
+    coalescer.add(1, 11, {"item": "paper", "available": 5})
+    coalescer.add(2, 10, {"item": "scanner", "available": 1})
+    assert published == []
+
+    coalescer.flush()
+    assert published == [
+        (1, {"item": "scanner", "available": 199}),
+        (1, {"item": "paper", "available": 5}),
+        (2, {"item": "scanner", "available": 1}),
+    ]
+
+
+def test_coalescer_flushes_after_window():
+    published = []
+    done = threading.Event()
+
+    def publish(tid, data):
+        published.append(data)
+        done.set()
+
+    coalescer = EventCoalescer(window=0.02, publish=publish)
+    coalescer.add(1, 1, {"n": 1})
+    coalescer.add(1, 1, {"n": 2})
+    assert done.wait(1)
+    assert published == [{"n": 2}]
+
+
+def test_inventory_mutations_publish_change_events(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    import event_bus
+    import inventory_core
+    from models import Base
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    published = []
+    coalescer = EventCoalescer(
+        window=60, publish=lambda tid, data: published.append((tid, data))
+    )
+    monkeypatch.setattr(event_bus, "change_coalescer", coalescer)
+
+    inventory_core.add_item(db, "drill", 5, 0, tenant_id=1)
+    inventory_core.issue_item(db, "drill", 2, tenant_id=1)
+    inventory_core.return_item(db, "drill", 1, tenant_id=1)
+    inventory_core.add_item(db, "saw", 1, 0, tenant_id=1)
+    inventory_core.delete_item(db, "saw", tenant_id=1)
+    inventory_core.transfer_item(db, "drill", 1, 1, 2)
+    coalescer.flush()
+
+    events = {(tid, data["item"]): data for tid, data in published}
+    assert len(published) == 3
+    assert events[(1, "drill")]["event"] == "transfer"
+    assert events[(1, "drill")]["available"] == 3
+    assert events[(1, "drill")]["in_use"] == 1
+    assert events[(1, "saw")]["event"] == "delete"
+    assert events[(2, "drill")]["available"] == 1
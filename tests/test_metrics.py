@@ -0,0 +1,73 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+from tests.conftest import METRICS_HEADERS, get_token
+
+
+def test_metrics_cover_routes_operations_and_limiter(client):
+    token = get_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post(
+        "/items/add",
+        json={
+            "name": "widget",
+            "quantity": 3,
+            "threshold": 0,
+            "min_par": 0,
+            "tenant_id": 1,
+        },
+        headers=headers,
+    )
+    client.get("/items/status?tenant_id=1", headers=headers)
+
+    body = client.get("/metrics", headers=METRICS_HEADERS).text
+    assert (
+        'http_requests_total{method="GET",route="/items/status",status="200"}' in body
+    )
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/token"' in body
+    assert 'inventory_operation_duration_seconds_count{operation="add_item"}' in body
+    assert 'db_statement_duration_seconds_count{statement="SELECT"}' in body
+    assert 'rate_limit_requests_total{policy="/token",result="allowed"}' in body
+
+
+def test_timed_records_duration_and_errors():
+    duration = metrics.Histogram("test_op_seconds", "Test", ("operation",))
+    errors = metrics.Counter("test_op_errors_total", "Test", ("operation",))
+
+    @metrics.timed(duration, errors)
+    def ok():
+        return 1
+
+    @metrics.timed(duration, errors)
+    async def fails():
+        raise ValueError
+
+    assert ok() == 1
+    with pytest.raises(ValueError):
+        fails().send(None)
+    assert duration.count("ok") == 1
+    assert duration.count("fails") == 1
+    assert errors.value("fails") == 1
+
+
+def test_standalone_metrics_server():
+    server = metrics.start_http_server(0, token="scrape")
+    try:
+        host, port = server.server_address[:2]
+        assert host == "127.0.0.1"
+        url = f"http://127.0.0.1:{port}/metrics"
+        with pytest.raises(urllib.error.HTTPError) as denied:
+            urllib.request.urlopen(url)
+        assert denied.value.code == 401
+        request = urllib.request.Request(
+            url, headers={"Authorization": "Bearer scrape"}
+        )
+        with urllib.request.urlopen(request) as resp:
+            assert resp.status == 200
+            assert "# TYPE" in resp.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
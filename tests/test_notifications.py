@@ -1,9 +1,14 @@
+from datetime import datetime, timedelta
+import asyncio
+import json
+
+import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from models import Base, Item, Notification, User
-from notifications import check_thresholds
-from websocket_manager import InventoryWSManager
+from models import Base, Item, Notification, NotificationOutbox, User
+from notifications import check_thresholds, dispatch_outbox
+from websocket_manager import InventoryWSManager, Subscription
 
 
 def setup_db():
@@ -63,13 +68,18 @@ def test_notification_logs_created():
     def fake_slack(msg):
         slacks.append(msg)
 
-    check_thresholds(db, email_func=fake_email, slack_func=fake_slack)
+    check_thresholds(db)
 
-    assert len(emails) == 1
-    assert len(slacks) == 1
     logs = db.query(Notification).all()
     assert len(logs) == 2
     assert all(log.item_id == item.id for log in logs)
+    assert db.query(NotificationOutbox).filter_by(status="pending").count() == 2
+
+    dispatch_outbox(db, email_func=fake_email, slack_func=fake_slack)
+
+    assert emails == ["e1@example.com"]
+    assert len(slacks) == 1
+    assert db.query(NotificationOutbox).filter_by(status="sent").count() == 2
 
 
 def test_no_notifications_when_stock_ok():
@@ -78,14 +88,86 @@ def test_no_notifications_when_stock_ok():
     db.add(item)
     db.commit()
 
-    emails = []
-    slacks = []
-
-    check_thresholds(db, email_func=emails.append, slack_func=slacks.append)
+    check_thresholds(db)
 
-    assert emails == []
-    assert slacks == []
     assert db.query(Notification).count() == 0
+    assert db.query(NotificationOutbox).count() == 0
+
+
+def _low_item(db):
+    item = Item(name="tape", available=0, in_use=0, threshold=1, min_par=0)
+    db.add(item)
+    db.commit()
+    return item
+
+
+def test_failed_delivery_is_retried_with_backoff():
+    db = setup_db()
+    _low_item(db)
+    check_thresholds(db)
+
+    def failing_slack(msg):
+        raise RuntimeError("webhook down")
+
+    counts = dispatch_outbox(db, email_func=None, slack_func=failing_slack)
+    assert counts == {"sent": 0, "retried": 1, "dead": 0}
+    entry = db.query(NotificationOutbox).filter_by(channel="slack").one()
+    assert entry.status == "pending"
+    assert entry.attempts == 1
+    assert entry.last_error == "webhook down"
+    assert entry.next_attempt_at > datetime.utcnow()
+
+    # Not due yet, so a second run leaves it alone
+    sent = []
+    counts = dispatch_outbox(db, email_func=None, slack_func=sent.append)
+    assert counts["sent"] == 0
+    assert sent == []
+
+    entry.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    dispatch_outbox(db, email_func=None, slack_func=sent.append)
+    assert len(sent) == 1
+    assert entry.status == "sent"
+
+
+def test_delivery_dead_lettered_after_max_attempts():
+    db = setup_db()
+    _low_item(db)
+    check_thresholds(db)
+
+    def failing_email(msg, to=None):
+        raise OSError("smtp unavailable")
+
+    for _ in range(3):
+        db.query(NotificationOutbox).update(
+            {NotificationOutbox.next_attempt_at: datetime.utcnow()}
+        )
+        db.commit()
+        dispatch_outbox(db, email_func=failing_email, slack_func=None, max_attempts=3)
+
+    entry = db.query(NotificationOutbox).filter_by(channel="email").one()
+    assert entry.status == "dead"
+    assert entry.attempts == 3
+    # The slack message is untouched when no slack sender is available
+    slack = db.query(NotificationOutbox).filter_by(channel="slack").one()
+    assert slack.status == "pending"
+    assert slack.attempts == 0
+
+
+def test_dispatch_respects_batch_size():
+    db = setup_db()
+    _low_item(db)
+    check_thresholds(db)
+
+    emails = []
+    counts = dispatch_outbox(
+        db,
+        email_func=lambda m, to=None: emails.append(m),
+        slack_func=None,
+        batch_size=1,
+    )
+    assert counts["sent"] == 1
+    assert len(emails) == 1
 
 
 def test_websocket_broadcast_on_low_stock():
@@ -109,9 +191,59 @@ def test_websocket_broadcast_on_low_stock():
 
     ws_mgr.broadcast = fake_broadcast
 
-    check_thresholds(db, email_func=None, slack_func=None, ws_manager=ws_mgr)
+    check_thresholds(db, ws_manager=ws_mgr)
 
     assert received
     tid, data = received[0]
     assert tid == 1
     assert data["event"] == "low_stock"
+
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_low_stock_reaches_department_subscriptions():
+    db = setup_db()
+    item = Item(
+        name="glue",
+        available=0,
+        in_use=0,
+        threshold=2,
+        min_par=0,
+        tenant_id=1,
+        department_id=2,
+        category_id=5,
+    )
+    db.add(item)
+    db.commit()
+
+    ws_mgr = InventoryWSManager()
+    dept, other_dept = FakeSocket(), FakeSocket()
+    for ws in (dept, other_dept):
+        await ws_mgr.connect(ws, 1)
+    ws_mgr.subscribe(dept, 1, Subscription(departments=[2], events=["low_stock"]))
+    ws_mgr.subscribe(other_dept, 1, Subscription(departments=[3]))
+
+    check_thresholds(db, ws_manager=ws_mgr)
+    for _ in range(50):
+        if dept.sent:
+            break
+        await asyncio.sleep(0.01)
+
+    event = json.loads(dept.sent[0])
+    assert event["event"] == "low_stock"
+    assert (event["item_id"], event["category_id"]) == (item.id, 5)
+    assert other_dept.sent == []
+    await ws_mgr.shutdown()
@@ -0,0 +1,66 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import settings
+from profiling import ProfilingMiddleware, StackSampler
+from tests.conftest import get_token
+
+
+def test_sampler_collapses_current_stack():
+    sampler = StackSampler(1.0)
+    sampler.sample()
+    assert any(
+        stack.endswith("profiling:sample")
+        and "test_profiling:test_sampler_collapses_current_stack" in stack
+        for stack in sampler.stacks
+    )
+
+
+def test_admin_can_profile_a_request(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path))
+    token = get_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = client.get("/items/status?tenant_id=1", headers=headers)
+    assert "x-profile-id" not in resp.headers
+    # The flag is ignored without an admin token
+    resp = client.get("/items/status?tenant_id=1", headers={"X-Profile": "1"})
+    assert "x-profile-id" not in resp.headers
+
+    resp = client.get(
+        "/items/status?tenant_id=1", headers={**headers, "X-Profile": "1"}
+    )
+    profile_id = resp.headers["x-profile-id"]
+    assert "-t1-GET-" in profile_id
+    assert (tmp_path / f"{profile_id}.collapsed").exists()
+
+    # Other tenants' and anonymous profiles stay hidden
+    for other in ("1-t2-GET-items_status", "2-anon-GET-token"):
+        (tmp_path / f"{other}.collapsed").write_text("main:app 1\n")
+        resp = client.get(f"/admin/profiles/{other}", headers=headers)
+        assert resp.status_code == 403
+    listed = client.get("/admin/profiles", headers=headers).json()
+    assert [p["id"] for p in listed] == [profile_id]
+    assert (
+        client.get(f"/admin/profiles/{profile_id}", headers=headers).status_code == 200
+    )
+    assert client.get("/admin/profiles/..%2Fmain", headers=headers).status_code == 404
+
+
+def test_sample_rate_profiles_to_disk(tmp_path):
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {}
+
+    app.add_middleware(
+        ProfilingMiddleware, sample_rate=1.0, directory=str(tmp_path), max_files=2
+    )
+    client = TestClient(app)
+    for _ in range(3):
+        resp = client.get("/ping")
+        assert resp.status_code == 200
+        # Sampled requests are stored without telling the client
+        assert "x-profile-id" not in resp.headers
+    assert len(list(tmp_path.glob("*-GET-ping.collapsed"))) == 2
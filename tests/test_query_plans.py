@@ -0,0 +1,155 @@
+from datetime import datetime
+import re
+
+from sqlalchemy import event
+
+from tests.conftest import get_token
+
+# A bare "SCAN <table>" step reads every row; scans that walk an index
+# ("SCAN t USING INDEX ...") are fine.
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+# Tables that are read in full on purpose (small lookup tables).
+FULL_SCAN_ALLOWED = {"departments", "tenants"}
+# Tables whose unfiltered reads are intended: check_thresholds notifies
+# every user. Filtered queries on them must still use an index.
+UNFILTERED_READS_ALLOWED = {"users"}
+
+
+def _capture(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, params, context, many):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if not many and verb in {"SELECT", "UPDATE", "DELETE"}:
+            statements.append((statement, params))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return statements, before_cursor_execute
+
+
+def _full_scans(engine, statements):
+    problems = []
+    with engine.connect() as conn:
+        for statement, params in statements:
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", params).all()
+            for row in plan:
+                match = FULL_SCAN.match(row[-1])
+                if not match or match.group(1) in FULL_SCAN_ALLOWED:
+                    continue
+                if match.group(1) in UNFILTERED_READS_ALLOWED and (
+                    "WHERE" not in statement
+                ):
+                    continue
+                problems.append(f"{row[-1]}: {statement}")
+    return problems
+
+
+def test_hot_queries_use_indexes(client):
+    import database
+    from inventory_core import (
+        get_item_history,
+        get_recent_logs,
+        get_status,
+        issue_item,
+        return_item,
+    )
+    from models import PasswordResetToken, Tenant
+    from notifications import check_thresholds, dispatch_outbox
+
+    engine = database.engine
+    statements, listener = _capture(engine)
+    try:
+        token = get_token(client)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        for name in ("widget", "gadget"):
+            client.post(
+                "/items/add",
+                json={
+                    "name": name,
+                    "quantity": 5,
+                    "threshold": 1,
+                    "min_par": 0,
+                    "tenant_id": 1,
+                },
+                headers=headers,
+            )
+        dept = client.post(
+            "/api/departments/", json={"name": "Ops"}, headers=headers
+        ).json()
+        client.post(
+            "/api/categories/",
+            json={"name": "Tools", "department_id": dept["id"]},
+            headers=headers,
+        )
+
+        for path in (
+            "/items/status?tenant_id=1",
+            "/items/status?tenant_id=1&name=widget",
+            "/items/history?tenant_id=1&name=widget",
+            "/audit/logs?tenant_id=1",
+            "/users/?tenant_id=1",
+            f"/api/categories/?department_id={dept['id']}",
+            "/analytics/usage/widget?tenant_id=1",
+            "/analytics/usage?tenant_id=1",
+        ):
+            assert client.get(path, headers=headers).status_code == 200, path
+
+        db = database.SessionLocal()
+        dest = Tenant(name="dest")
+        db.add(dest)
+        db.commit()
+        dest_id = dest.id
+        db.close()
+        for method, path, body in (
+            ("PUT", "/items/update", {"name": "gadget", "tenant_id": 1, "min_par": 1}),
+            (
+                "POST",
+                "/items/transfer",
+                {
+                    "name": "widget",
+                    "quantity": 1,
+                    "from_tenant_id": 1,
+                    "to_tenant_id": dest_id,
+                },
+            ),
+            ("DELETE", "/items/delete", {"name": "gadget", "tenant_id": 1}),
+        ):
+            resp = client.request(method, path, json=body, headers=headers)
+            assert resp.status_code == 200, path
+
+        reset = client.post("/auth/request-reset", json={"username": "admin"})
+        resp = client.post(
+            "/auth/reset-password",
+            json={"token": reset.json()["reset_token"], "new_password": "admin"},
+        )
+        assert resp.status_code == 200
+
+        db = database.SessionLocal()
+        try:
+            get_status(db, 1)
+            get_item_history(db, "widget", 1)
+            get_recent_logs(db, 10, 1)
+            get_recent_logs(db, 10)
+            # Leaves widget below its threshold for the notification queries
+            issue_item(db, "widget", 4, 1)
+            return_item(db, "widget", 1, 1)
+            issue_item(db, "widget", 1, 1)
+            check_thresholds(db)
+            sent = dispatch_outbox(
+                db, email_func=lambda message, to: None, slack_func=lambda m: None
+            )
+            assert sent["sent"] > 0
+            # Purging expired reset tokens
+            db.query(PasswordResetToken).filter(
+                PasswordResetToken.expires_at < datetime.utcnow()
+            ).delete()
+            db.rollback()
+        finally:
+            db.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert statements
+    assert _full_scans(engine, statements) == []
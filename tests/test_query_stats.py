@@ -0,0 +1,62 @@
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from query_stats import QueryStatsMiddleware, current_stats
+
+
+def _app(tmp_path):
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/stats.db")
+    app = FastAPI()
+
+    @app.get("/loop")
+    def loop(n: int):
+        with engine.connect() as conn:
+            for i in range(n):
+                conn.execute(text("SELECT :i"), {"i": i})
+        return {}
+
+    @app.get("/async")
+    async def run_async():
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+        return {}
+
+    app.add_middleware(QueryStatsMiddleware, debug=True, budget=5, repeat_threshold=3)
+    return app
+
+
+def test_counts_statements_per_request(tmp_path):
+    client = TestClient(_app(tmp_path))
+
+    resp = client.get("/loop", params={"n": 2})
+    assert resp.headers["x-db-queries"] == "2"
+    assert float(resp.headers["x-db-time-ms"]) >= 0
+
+    resp = client.get("/async")
+    assert resp.headers["x-db-queries"] == "2"
+    # Statements outside a request are not attributed to anything
+    assert current_stats() is None
+
+
+def test_logs_budget_and_repeated_statements(tmp_path, caplog):
+    client = TestClient(_app(tmp_path))
+
+    with caplog.at_level(logging.WARNING, logger="query_stats"):
+        client.get("/loop", params={"n": 2})
+        assert caplog.records == []
+
+        client.get("/loop", params={"n": 6})
+    messages = [r.getMessage() for r in caplog.records]
+    assert any("issued 6 SQL statements (budget 5" in m for m in messages)
+    assert any("Possible N+1 in GET /loop" in m and "6 times" in m for m in messages)
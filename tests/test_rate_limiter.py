@@ -1,4 +1,14 @@
-from tests.conftest import get_token
+import asyncio
+
+import pytest
+
+from rate_limiter import (
+    MemoryBackend,
+    RateLimiter,
+    RateLimitMiddleware,
+    parse_policies,
+)
+from tests.conftest import METRICS_HEADERS, get_token
 
 
 def test_rate_limiter_blocks_excess_token_requests(client):
@@ -14,3 +24,196 @@ def test_rate_limiter_blocks_excess_token_requests(client):
         headers={"Content-Type": "application/x-www-form-urlencoded"},
     )
     assert resp.status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_redis_sliding_window_is_atomic_under_concurrency():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    limiter = RateLimiter(
+        limit=10,
+        window=60,
+        routes=["/token"],
+        redis_url="redis://unused",
+        redis_client=client,
+    )
+
+    results = await asyncio.gather(
+        *(limiter.allow("rl:1.2.3.4:/token") for _ in range(50))
+    )
+    assert sum(results) == 10
+    assert await client.zcard("rl:1.2.3.4:/token") == 10
+    assert 0 < await client.pttl("rl:1.2.3.4:/token") <= 60_000
+    assert await limiter.allow("rl:5.6.7.8:/token")
+
+    await limiter.record_throttled(1, "1.2.3.4:/token")
+    await limiter.record_throttled(1, "1.2.3.4:/token")
+    await limiter.record_throttled(1, "5.6.7.8:/token")
+    assert await limiter.top_throttled(1) == [
+        ("1.2.3.4:/token", 2),
+        ("5.6.7.8:/token", 1),
+    ]
+    assert await limiter.top_throttled(2) == []
+
+    for i in range(1200):
+        await client.set(f"rl:bulk{i}", 1)
+    batches = [keys async for keys in limiter.scan_keys(batch=100)]
+    assert sum(len(keys) for keys in batches) == 1203
+
+    await limiter.reset()
+    assert await client.dbsize() == 0
+    assert await limiter.allow("rl:1.2.3.4:/token")
+
+
+def test_memory_backend_gcra_allows_burst_then_refills():
+    backend = MemoryBackend()
+    assert all(backend.allow("k", 5, 60, now=0.0) for _ in range(5))
+    assert not backend.allow("k", 5, 60, now=0.0)
+    # One slot frees up every window / limit seconds
+    assert not backend.allow("k", 5, 60, now=11.9)
+    assert backend.allow("k", 5, 60, now=12.0)
+    assert len(backend) == 1
+
+
+def test_memory_backend_evicts_idle_and_excess_keys():
+    backend = MemoryBackend(max_keys=3)
+    for i in range(5):
+        backend.allow(f"client{i}", 5, 60, now=0.0)
+    assert len(backend) == 3
+
+    assert backend.sweep(now=12.0) == 3
+    assert len(backend) == 0
+    backend.allow("client0", 5, 60, now=100.0)
+    assert len(backend) == 1
+
+
+def test_token_responses_carry_ratelimit_headers(client):
+    resp = client.post(
+        "/token",
+        data={"username": "admin", "password": "admin"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert resp.headers["RateLimit-Limit"] == "5"
+    assert resp.headers["RateLimit-Remaining"] == "4"
+    for _ in range(4):
+        get_token(client)
+    resp = client.post(
+        "/token",
+        data={"username": "admin", "password": "admin"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert resp.status_code == 429
+    assert resp.headers["RateLimit-Remaining"] == "0"
+    assert int(resp.headers["Retry-After"]) > 0
+
+    resp = client.get("/metrics", headers=METRICS_HEADERS)
+    assert resp.status_code == 200
+    assert "RateLimit-Limit" not in resp.headers
+
+
+def test_policies_match_longest_prefix():
+    limiter = RateLimiter(
+        limit=5,
+        window=60,
+        routes=["/users"],
+        redis_url="memory://",
+        policies=parse_policies("/analytics=30/60:tenant, /analytics/export=2/10:user"),
+    )
+    assert limiter.match("/users/bulk").prefix == "/users"
+    assert limiter.match("/usersx") is None
+    assert limiter.match("/items/status") is None
+    assert limiter.limits(limiter.match("/analytics/low-stock")) == (30, 60)
+    export = limiter.match("/analytics/export/csv")
+    assert (export.scope, limiter.limits(export)) == ("user", (2, 10))
+    limiter.limit = 1000
+    assert limiter.limits(limiter.match("/users/")) == (1000, 60)
+
+
+def test_tenant_policy_counts_per_tenant_claim():
+    from jose import jwt
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from config import settings
+
+    app = Starlette(routes=[Route("/analytics", lambda r: PlainTextResponse("ok"))])
+    limiter = RateLimiter(
+        limit=5,
+        window=60,
+        routes=[],
+        redis_url="memory://",
+        policies=parse_policies("/analytics=2/60:tenant"),
+    )
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    def auth(sub, tenant_id):
+        claims = {"sub": sub, "tenant_id": tenant_id}
+        token = jwt.encode(claims, settings.secret_key, algorithm="HS256")
+        return {"Authorization": f"Bearer {token}"}
+
+    with TestClient(app) as test_client:
+        assert test_client.get("/analytics", headers=auth("a", 1)).status_code == 200
+        assert test_client.get("/analytics", headers=auth("b", 1)).status_code == 200
+        assert test_client.get("/analytics", headers=auth("c", 1)).status_code == 429
+        assert test_client.get("/analytics", headers=auth("d", 2)).status_code == 200
+
+
+def test_prefix_policy_shares_one_budget_across_paths():
+    from jose import jwt
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from config import settings
+
+    app = Starlette(
+        routes=[Route("/analytics/usage/{item}", lambda r: PlainTextResponse("ok"))]
+    )
+    limiter = RateLimiter(
+        limit=5,
+        window=60,
+        routes=[],
+        redis_url="memory://",
+        policies=parse_policies("/analytics=2/60:tenant"),
+    )
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    token = jwt.encode(
+        {"sub": "a", "tenant_id": 1}, settings.secret_key, algorithm="HS256"
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with TestClient(app) as test_client:
+        statuses = [
+            test_client.get(f"/analytics/usage/item{i}", headers=headers).status_code
+            for i in range(6)
+        ]
+    assert statuses == [200, 200, 429, 429, 429, 429]
+    assert list(limiter._memory_store.keys()) == ["rl:tenant:1:/analytics"]
+
+
+def test_admin_lists_top_throttled_clients_of_own_tenant(client):
+    token = get_token(client)
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    form = {"username": "admin", "password": "admin"}
+    for _ in range(6):
+        client.post("/token", data=form, headers=headers)
+
+    resp = client.get(
+        "/admin/rate-limits/throttled?tenant_id=1",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert resp.status_code == 200
+    assert resp.json() == [{"client": "testclient:/token", "rejected": 2}]
+
+    resp = client.get(
+        "/admin/rate-limits/throttled?tenant_id=2",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert resp.status_code == 403
@@ -0,0 +1,64 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import database
+from read_routing import ReadYourWritesMiddleware, prefer_primary
+
+
+def _sessionmaker(url):
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+
+def _bound_url(dependency):
+    gen = dependency()
+    db = next(gen)
+    url = str(db.get_bind().url)
+    gen.close()
+    return url
+
+
+def test_get_read_db_uses_replica_with_fallbacks(tmp_path, monkeypatch):
+    primary = _sessionmaker(f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setattr(database, "SessionLocal", primary)
+    monkeypatch.setattr(database, "ReadSessionLocal", None)
+    assert _bound_url(database.get_read_db).endswith("primary.db")
+
+    replica = _sessionmaker(f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setattr(database, "ReadSessionLocal", replica)
+    assert _bound_url(database.get_read_db).endswith("replica.db")
+
+    token = prefer_primary.set(True)
+    try:
+        assert _bound_url(database.get_read_db).endswith("primary.db")
+    finally:
+        prefer_primary.reset(token)
+
+    unreachable = _sessionmaker(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    monkeypatch.setattr(database, "ReadSessionLocal", unreachable)
+    assert _bound_url(database.get_read_db).endswith("primary.db")
+
+
+def test_writes_make_following_reads_sticky_to_primary():
+    async def read(request):
+        return JSONResponse({"primary": prefer_primary.get()})
+
+    async def write(request):
+        return JSONResponse({"ok": True})
+
+    app = Starlette(
+        routes=[Route("/read", read), Route("/write", write, methods=["POST"])]
+    )
+    app.add_middleware(ReadYourWritesMiddleware, seconds=30)
+
+    with TestClient(app) as client:
+        assert client.get("/read").json() == {"primary": False}
+        resp = client.post("/write")
+        assert "rw_primary=" in resp.headers["set-cookie"]
+        assert client.get("/read").json() == {"primary": True}
+        client.cookies.clear()
+        assert client.get("/read").json() == {"primary": False}
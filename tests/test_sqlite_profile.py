@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import Base
+from models import Tenant
+from sqlite_profile import SerializedWriteSession, _write_lock, apply_sqlite_profile
+
+
+def test_profile_pragmas_applied_on_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+    apply_sqlite_profile(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -65536
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_async_writers_are_serialized(tmp_path):
+    path = tmp_path / "writers.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sync_engine)
+    sync_engine.dispose()
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    apply_sqlite_profile(engine.sync_engine)
+    Session = async_sessionmaker(
+        engine, expire_on_commit=False, sync_session_class=SerializedWriteSession
+    )
+    active = 0
+    overlap = 0
+
+    async def writer(i):
+        nonlocal active, overlap
+        async with Session() as session:
+            session.add(Tenant(name=f"tenant-{i}"))
+            await session.flush()
+            assert _write_lock().locked()
+            active += 1
+            overlap = max(overlap, active)
+            await asyncio.sleep(0.001)
+            active -= 1
+            await session.commit()
+
+    async def reader():
+        async with Session() as session:
+            return (
+                await session.execute(text("SELECT count(*) FROM tenants"))
+            ).scalar()
+
+    results = await asyncio.gather(*(writer(i) for i in range(20)), reader())
+    assert overlap == 1
+    assert not _write_lock().locked()
+    assert results[-1] <= 20
+    assert await reader() == 20
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_textual_writes_take_the_write_lock(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'text.db'}")
+    Session = async_sessionmaker(engine, sync_session_class=SerializedWriteSession)
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE t (v TEXT)"))
+
+    async with Session() as session:
+        await session.execute(text("SELECT count(*) FROM t"))
+        assert not _write_lock().locked()
+        await session.execute(text("INSERT INTO t (v) VALUES ('a')"))
+        assert _write_lock().locked()
+        await session.commit()
+    assert not _write_lock().locked()
+    await engine.dispose()
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+# Generous ceiling for a cold "import main"; catches accidental heavy work
+# (engine creation, schema checks, network calls) at import time.
+IMPORT_BUDGET_SECONDS = 5.0
+
+
+def _import_times(tmp_path, code):
+    env = dict(
+        os.environ,
+        SECRET_KEY="test-secret",
+        DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}",
+        PYTHONPATH=str(REPO),
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    times = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_importing_main_creates_no_engine_or_database(tmp_path):
+    times = _import_times(
+        tmp_path,
+        "import main, database, database_async\n"
+        "assert 'engine' not in vars(database)\n"
+        "assert 'async_engine' not in vars(database_async)\n",
+    )
+    assert not (tmp_path / "startup.db").exists()
+    assert times["main"] < IMPORT_BUDGET_SECONDS
+
+
+def test_worker_import_skips_web_stack(tmp_path):
+    times = _import_times(tmp_path, "import tasks, inventory")
+    assert "fastapi" not in times
+    assert not (tmp_path / "startup.db").exists()
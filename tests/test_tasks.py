@@ -18,3 +18,16 @@ def test_check_stock_levels_invokes_notifications(monkeypatch):
 
     tasks.check_stock_levels()
     assert called.get("ran")
+
+
+def test_dispatch_notifications_drains_outbox(monkeypatch):
+    calls = []
+
+    def fake_dispatch(db):
+        calls.append(db)
+        return {"sent": 0, "retried": 0, "dead": 0}
+
+    monkeypatch.setattr(tasks, "dispatch_outbox", fake_dispatch)
+
+    tasks.dispatch_notifications()
+    assert len(calls) == 1
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+from celery.app.task import Context
+import pytest
+
+import tracing
+from tests.conftest import get_token
+
+
+class ListExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(list(spans))
+
+
+@pytest.fixture
+def exporter():
+    exporter = ListExporter()
+    tracing.set_exporter(exporter)
+    yield exporter
+    tracing.set_exporter(None)
+
+
+def test_request_spans_cover_auth_core_and_sql(client, exporter):
+    token = get_token(client)
+    client.post(
+        "/items/add",
+        json={
+            "name": "widget",
+            "quantity": 1,
+            "threshold": 0,
+            "min_par": 0,
+            "tenant_id": 1,
+        },
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    incoming = "00-" + "ab" * 16 + "-" + "cd" * 8 + "-01"
+    resp = client.get(
+        "/items/status?tenant_id=1",
+        headers={"Authorization": f"Bearer {token}", "traceparent": incoming},
+    )
+    assert resp.status_code == 200
+
+    spans = exporter.traces[-1]
+    by_name = {span.name: span for span in spans}
+    root = by_name["GET /items/status"]
+    assert root.trace_id == "ab" * 16
+    assert root.parent_id == "cd" * 8
+    assert root.attributes["http.status_code"] == 200
+    assert resp.headers["traceparent"] == root.traceparent()
+    assert by_name["auth.get_current_user"].parent_id == root.span_id
+    assert "inventory_core.get_status" in by_name
+    assert "db.statement" in by_name
+    assert {span.trace_id for span in spans} == {"ab" * 16}
+
+    doc = tracing.otlp_document(spans)
+    otlp = doc["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {s["name"] for s in otlp} == set(by_name)
+
+
+def test_cache_calls_are_traced(exporter):
+    from cache import get_cached
+
+    with tracing.span("job", root=True):
+        get_cached("missing-key")
+    assert [s.name for s in exporter.traces[-1]] == ["cache.get_cached", "job"]
+
+
+def test_traceparent_propagates_into_celery_tasks(exporter):
+    import tasks
+
+    with tracing.span("enqueue", root=True) as parent:
+        headers = {}
+        tasks._inject_traceparent(headers=headers)
+    assert headers["traceparent"] == parent.traceparent()
+
+    task = SimpleNamespace(name="tasks.check_stock_levels", request=Context(headers))
+    tasks._task_prerun(task_id="t1", task=task)
+    with tracing.span("inside"):
+        pass
+    tasks._task_postrun(task_id="t1", task=task, state="SUCCESS")
+
+    task_span, inside = exporter.traces[-1][-1], exporter.traces[-1][0]
+    assert task_span.name == "celery tasks.check_stock_levels"
+    assert task_span.trace_id == parent.trace_id
+    assert task_span.parent_id == parent.span_id
+    assert inside.parent_id == task_span.span_id
+    assert tracing.current_span() is None
+
+
+def test_disabled_tracing_records_nothing():
+    tracing.set_exporter(None)
+    with tracing.span("job", root=True) as span:
+        assert span is None
+    assert tracing.current_span() is None
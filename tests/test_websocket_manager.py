@@ -0,0 +1,329 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import metrics
+from websocket_manager import (
+    IDLE_CLOSE_CODE,
+    InventoryWSManager,
+    SLOW_CONSUMER_CLOSE_CODE,
+    Subscription,
+    TOO_MANY_CONNECTIONS_CLOSE_CODE,
+)
+
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.sent: list[str] = []
+        self.closed: int | None = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        self.closed = code
+
+
+async def _drain(manager: InventoryWSManager, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conns = [c for t in manager.connections.values() for c in t.values()]
+        if all(c.queue.empty() for c in conns):
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_does_not_wait_for_slow_sockets():
+    manager = InventoryWSManager(max_queue=16)
+    slow = [FakeSocket(delay=0.05) for _ in range(300)]
+    fast = FakeSocket()
+    for ws in slow + [fast]:
+        await manager.connect(ws, 1)
+
+    start = time.perf_counter()
+    for i in range(5):
+        await manager.broadcast(1, {"event": "update", "n": i})
+    assert time.perf_counter() - start < 0.05
+
+    await _drain(manager)
+    assert [json.loads(m)["n"] for m in fast.sent] == [0, 1, 2, 3, 4]
+    assert all(len(ws.sent) == 5 for ws in slow)
+    # Serialized once and shared by every connection
+    first = fast.sent[0]
+    assert all(ws.sent[0] is first for ws in slow)
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumers_disconnected_on_overflow():
+    manager = InventoryWSManager(max_queue=4)
+    slow = [FakeSocket(delay=10) for _ in range(200)]
+    fast = [FakeSocket() for _ in range(5)]
+    for ws in slow + fast:
+        await manager.connect(ws, 1)
+
+    for i in range(10):
+        await manager.broadcast(1, {"n": i})
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+    assert all(ws.closed == SLOW_CONSUMER_CLOSE_CODE for ws in slow)
+    assert set(manager.connections[1]) == set(fast)
+    assert all(len(ws.sent) == 10 for ws in fast)
+    await manager.shutdown()
+    assert not manager.connections
+
+
+@pytest.mark.asyncio
+async def test_drop_policy_keeps_latest_messages():
+    manager = InventoryWSManager(max_queue=2, overflow="drop")
+    ws = FakeSocket(delay=0.05)
+    await manager.connect(ws, 1)
+
+    for i in range(6):
+        await manager.broadcast(1, {"n": i})
+    await _drain(manager)
+
+    assert ws.closed is None
+    received = [json.loads(m)["n"] for m in ws.sent]
+    assert received[-2:] == [4, 5]
+    assert manager.connections[1][ws].dropped > 0
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_failed_send_removes_connection():
+    class BrokenSocket(FakeSocket):
+        async def send_text(self, text):
+            raise RuntimeError("gone")
+
+    manager = InventoryWSManager()
+    ws = BrokenSocket()
+    await manager.connect(ws, 7)
+    await manager.broadcast(7, {"event": "update"})
+    await asyncio.sleep(0.01)
+    assert 7 not in manager.connections
+
+
+@pytest.mark.asyncio
+async def test_events_carry_per_tenant_sequence_numbers():
+    manager = InventoryWSManager()
+    ws1, ws2 = FakeSocket(), FakeSocket()
+    await manager.connect(ws1, 1)
+    await manager.connect(ws2, 2)
+
+    await manager.broadcast(1, {"n": "a"})
+    await manager.broadcast(1, {})
+    await manager.broadcast(2, {"n": "c"})
+    await _drain(manager, timeout=0.2)
+
+    assert [json.loads(m) for m in ws1.sent] == [{"seq": 1, "n": "a"}, {"seq": 2}]
+    assert [json.loads(m)["seq"] for m in ws2.sent] == [1]
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_replays_missed_events():
+    manager = InventoryWSManager(replay_size=5)
+    dropped = FakeSocket()
+    await manager.connect(dropped, 1)
+    manager.disconnect(dropped, 1)
+    for i in range(4):
+        await manager.broadcast(1, {"n": i})
+
+    ws = FakeSocket()
+    await manager.connect(ws, 1, since=2)
+    await manager.broadcast(1, {"n": 4})
+    await _drain(manager, timeout=0.2)
+
+    assert [json.loads(m)["seq"] for m in ws.sent] == [3, 4, 5]
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_with_expired_gap_requires_resync():
+    manager = InventoryWSManager(replay_size=3)
+    dropped = FakeSocket()
+    await manager.connect(dropped, 1)
+    manager.disconnect(dropped, 1)
+    for i in range(10):
+        await manager.broadcast(1, {"n": i})
+
+    stale, future, current = FakeSocket(), FakeSocket(), FakeSocket()
+    await manager.connect(stale, 1, since=2)
+    await manager.connect(future, 1, since=50)
+    await manager.connect(current, 1, since=10)
+    await _drain(manager, timeout=0.2)
+
+    assert json.loads(stale.sent[0]) == {"event": "resync_required", "seq": 10}
+    assert json.loads(future.sent[0])["event"] == "resync_required"
+    assert current.sent == []
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_replay_buffers_only_for_tenants_with_local_sockets():
+    manager = InventoryWSManager(replay_ttl=60, replay_max_tenants=2)
+    for tenant_id in range(100):
+        await manager.broadcast(tenant_id, {"n": 1})
+    assert not manager._history and not manager._seq
+
+    sockets = {t: FakeSocket() for t in (1, 2, 3, 4)}
+    for tenant_id, ws in sockets.items():
+        await manager.connect(ws, tenant_id)
+    for tenant_id, ws in sockets.items():
+        await manager.broadcast(tenant_id, {"n": 2})
+        manager.disconnect(ws, tenant_id)
+    # Only the two most recently used idle tenants are kept
+    assert list(manager._history) == [3, 4]
+
+    resumed = FakeSocket()
+    await manager.connect(resumed, 4, since=0)
+    await _drain(manager, timeout=0.2)
+    assert [e["n"] for e in _events(resumed)] == [2]
+
+    manager.prune_history(now=time.monotonic() + 120)
+    assert list(manager._history) == [4]
+    await manager.shutdown()
+
+
+def _events(ws: FakeSocket) -> list[dict]:
+    return [json.loads(m) for m in ws.sent]
+
+
+@pytest.mark.asyncio
+async def test_subscriptions_filter_events_by_item_department_and_type():
+    manager = InventoryWSManager()
+    everything, by_item, by_dept, low_only, dept_low = (FakeSocket() for _ in range(5))
+    for ws in (everything, by_item, by_dept, low_only, dept_low):
+        await manager.connect(ws, 1)
+    manager.subscribe(everything, 1, None)
+    manager.subscribe(by_item, 1, Subscription(items=["drill"]))
+    manager.subscribe(by_dept, 1, Subscription(departments=[2]))
+    manager.subscribe(low_only, 1, Subscription(events=["low_stock"]))
+    manager.subscribe(dept_low, 1, Subscription(departments=[2], events=["low_stock"]))
+
+    await manager.broadcast(1, {"event": "update", "item": "drill", "department_id": 1})
+    await manager.broadcast(1, {"event": "update", "item": "saw", "department_id": 2})
+    await manager.broadcast(
+        1, {"event": "low_stock", "item": "glue", "department_id": 2}
+    )
+    await _drain(manager, timeout=0.2)
+
+    assert [e["item"] for e in _events(everything)] == ["drill", "saw", "glue"]
+    assert [e["item"] for e in _events(by_item)] == ["drill"]
+    assert [e["item"] for e in _events(by_dept)] == ["saw", "glue"]
+    assert [e["item"] for e in _events(low_only)] == ["glue"]
+    assert [e["item"] for e in _events(dept_low)] == ["glue"]
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_messages_update_the_index():
+    manager = InventoryWSManager()
+    ws = FakeSocket()
+    await manager.connect(ws, 1)
+
+    manager.handle_message(ws, 1, json.dumps({"action": "subscribe", "items": "a"}))
+    await manager.broadcast(1, {"event": "update", "item": "b"})
+    await manager.broadcast(1, {"event": "update", "item": "a"})
+    manager.handle_message(ws, 1, json.dumps({"action": "unsubscribe"}))
+    await manager.broadcast(1, {"event": "update", "item": "b"})
+    manager.handle_message(ws, 1, "not json")
+    await _drain(manager, timeout=0.2)
+
+    assert [e.get("item", e["event"]) for e in _events(ws)] == [
+        "subscribed",
+        "a",
+        "unsubscribed",
+        "b",
+        "error",
+    ]
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_skips_uninterested_sockets():
+    manager = InventoryWSManager()
+    sockets = [FakeSocket() for _ in range(500)]
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, 1)
+        manager.subscribe(ws, 1, Subscription(items=[f"item{i}"]))
+
+    await manager.broadcast(1, {"event": "update", "item": "item42"})
+    queued = [
+        ws
+        for ws, conn in manager.connections[1].items()
+        if not conn.queue.empty() or ws.sent
+    ]
+    assert queued == [sockets[42]]
+
+    manager.disconnect(sockets[42], 1)
+    assert not manager._index[1].by_item["item42"]
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_connections_capped_per_tenant():
+    manager = InventoryWSManager(max_per_tenant=2)
+    sockets = [FakeSocket() for _ in range(3)]
+    results = [await manager.connect(ws, 1) for ws in sockets]
+
+    assert results == [True, True, False]
+    assert sockets[2].closed == TOO_MANY_CONNECTIONS_CLOSE_CODE
+    assert await manager.connect(FakeSocket(), 2)
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_idle_connections_are_reaped_and_active_ones_pinged():
+    manager = InventoryWSManager(heartbeat_interval=0.05, heartbeat_timeout=0.12)
+    idle, active = FakeSocket(), FakeSocket()
+    await manager.connect(idle, 1)
+    await manager.connect(active, 1)
+
+    for _ in range(6):
+        await asyncio.sleep(0.05)
+        manager.handle_message(active, 1, json.dumps({"action": "pong"}))
+
+    assert idle.closed == IDLE_CLOSE_CODE
+    assert list(manager.connections[1]) == [active]
+    assert any(e["event"] == "ping" for e in _events(active))
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_connection_gauges_exported():
+    manager = InventoryWSManager()
+    ws = FakeSocket(delay=10)
+    await manager.connect(ws, 5)
+    await manager.broadcast(5, {"event": "update", "item": "x"})
+    await manager.broadcast(5, {"event": "update", "item": "y"})
+
+    stats = manager.stats()
+    assert stats["connections"] == {5: 1}
+    assert stats["queued_bytes"][5] > 0
+
+    rendered = metrics.registry.render()
+    assert "tenant_id" not in rendered
+    assert _gauge(rendered, "ws_connections") >= 1
+    assert _gauge(rendered, "ws_queued_bytes") > 0
+    before = _gauge(rendered, "ws_connections")
+    await manager.shutdown()
+    assert _gauge(metrics.registry.render(), "ws_connections") == before - 1
+
+
+def _gauge(rendered: str, name: str) -> float:
+    for line in rendered.splitlines():
+        if line.startswith(f"{name} "):
+            return float(line.split()[1])
+    raise AssertionError(f"{name} not rendered")
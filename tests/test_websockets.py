@@ -23,6 +23,7 @@ os.environ.setdefault("SECRET_KEY", "test-secret")
 import database_async  # noqa: E402
 import database  # noqa: E402
 import main  # noqa: E402
+import auth  # noqa: E402
 from auth import get_password_hash  # noqa: E402
 
 
@@ -52,6 +53,7 @@ def client():
     database_async.async_engine = async_engine
     database_async.AsyncSessionLocal = TestingAsyncSessionLocal
     main.app.router.on_startup.clear()
+    auth.clear_principal_cache()
 
     database.Base.metadata.create_all(bind=engine)
 
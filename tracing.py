@@ -0,0 +1,385 @@
+"""Lightweight request tracing with OTLP/JSON compatible export.
+
+Spans live in a context variable, so they follow a request into threadpool
+workers and ``await`` boundaries. ``TracingMiddleware`` opens a root span
+per HTTP request (continuing an incoming W3C ``traceparent``), and
+``span``/``traced`` open children for auth, ``inventory_core``, the cache,
+SQL statements and websocket fan-out. Celery tasks continue the trace of
+whoever enqueued them through a ``traceparent`` message header.
+
+When a root span ends, its trace is handed to the exporter selected by
+``TRACING_EXPORTER``: ``console`` logs one OTLP/JSON document per trace and
+``file`` appends them as JSON lines to ``TRACING_FILE``. Both can be replayed
+to an OpenTelemetry collector. With the exporter unset every helper returns
+immediately.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import functools
+import inspect
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_CONSUMER = 5
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class _Trace:
+    """Spans finished so far for one trace within this process."""
+
+    def __init__(self, trace_id: str) -> None:
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        trace: _Trace,
+        parent_id: Optional[str] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+        attributes: Optional[Dict[str, object]] = None,
+    ) -> None:
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value: object) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.attributes["exception.type"] = type(exc).__name__
+        self.attributes["exception.message"] = str(exc)
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: object) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def otlp_document(spans: List[Span]) -> dict:
+    """An OTLP/JSON ``ExportTraceServiceRequest`` for ``spans``."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        _otlp_attribute("service.name", settings.tracing_service_name)
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [span.to_otlp() for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class ConsoleExporter:
+    def export(self, spans: List[Span]) -> None:
+        logger.info("%s", json.dumps(otlp_document(spans), separators=(",", ":")))
+
+
+class FileExporter:
+    """Append one OTLP/JSON document per trace to ``path``."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        line = json.dumps(otlp_document(spans), separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+
+
+_exporter = None
+_configured = False
+
+
+def get_exporter():
+    """The exporter chosen by ``TRACING_EXPORTER``, or ``None`` when off."""
+    global _exporter, _configured
+    if not _configured:
+        kind = (settings.tracing_exporter or "").lower()
+        if kind == "console":
+            _exporter = ConsoleExporter()
+        elif kind == "file":
+            _exporter = FileExporter(settings.tracing_file)
+        elif kind:
+            logger.warning("Unknown TRACING_EXPORTER %r; tracing disabled", kind)
+        _configured = True
+    return _exporter
+
+
+def set_exporter(exporter) -> None:
+    """Install an exporter (``None`` disables tracing)."""
+    global _exporter, _configured
+    _exporter = exporter
+    _configured = True
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace id, parent span id) from a W3C ``traceparent`` header."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+def start_span(
+    name: str,
+    kind: int = SPAN_KIND_INTERNAL,
+    root: bool = False,
+    traceparent: Optional[str] = None,
+    **attributes,
+) -> Optional[Span]:
+    """Start a span under the current one; ``root`` spans may begin a trace.
+
+    Returns ``None`` (and records nothing) when tracing is off, when there
+    is no current span and ``root`` is false, or when a new trace is not
+    sampled.
+    """
+    if get_exporter() is None:
+        return None
+    parent = _current.get()
+    if parent is not None:
+        return Span(name, parent.trace, parent.span_id, kind, attributes)
+    if not root:
+        return None
+    remote = parse_traceparent(traceparent)
+    if remote is not None:
+        return Span(name, _Trace(remote[0]), remote[1], kind, attributes)
+    if random.random() >= settings.tracing_sample_rate:
+        return None
+    return Span(name, _Trace(secrets.token_hex(16)), None, kind, attributes)
+
+
+def activate(span: Span) -> Token:
+    """Make ``span`` current; undo with ``deactivate``."""
+    return _current.set(span)
+
+
+def deactivate(token: Token) -> None:
+    _current.reset(token)
+
+
+def finish_span(span: Span, local_root: bool) -> None:
+    span.end()
+    if local_root:
+        exporter = get_exporter()
+        if exporter is not None:
+            try:
+                exporter.export(span.trace.spans)
+            except Exception:
+                logger.exception("Failed to export trace %s", span.trace_id)
+
+
+@contextmanager
+def span(
+    name: str,
+    kind: int = SPAN_KIND_INTERNAL,
+    root: bool = False,
+    traceparent: Optional[str] = None,
+    **attributes,
+) -> Iterator[Optional[Span]]:
+    """Run the block in a child span (see ``start_span``)."""
+    current = start_span(name, kind, root, traceparent, **attributes)
+    if current is None:
+        yield None
+        return
+    local_root = _current.get() is None
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.record_exception(exc)
+        raise
+    finally:
+        _current.reset(token)
+        finish_span(current, local_root)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator running a plain or ``async`` function in a span."""
+
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__name__}"
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return await func(*args, **kwargs)
+                with span(span_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if _current.get() is None:
+        return
+    sql_span = start_span(
+        "db.statement",
+        SPAN_KIND_CLIENT,
+        **{"db.system": conn.dialect.name, "db.statement": statement},
+    )
+    if sql_span is not None:
+        conn.info.setdefault("trace_spans", []).append(sql_span)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        finish_span(spans.pop(), local_root=False)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context) -> None:
+    conn = exception_context.connection
+    spans = conn.info.get("trace_spans") if conn is not None else None
+    if spans:
+        sql_span = spans.pop()
+        sql_span.record_exception(exception_context.original_exception)
+        finish_span(sql_span, local_root=False)
+
+
+def _header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class TracingMiddleware:
+    """Open a server span for every HTTP request and return its ``traceparent``."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or get_exporter() is None:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        with span(
+            f"{method} {scope['path']}",
+            SPAN_KIND_SERVER,
+            root=True,
+            traceparent=_header(scope, b"traceparent"),
+            **{"http.method": method, "http.target": scope["path"]},
+        ) as server_span:
+            if server_span is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_trace(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    server_span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        server_span.status = STATUS_ERROR
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"traceparent", server_span.traceparent().encode())
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    server_span.name = f"{method} {route}"
+                    server_span.set_attribute("http.route", route)
@@ -1,28 +1,502 @@
-from typing import Dict, Set
-from collections import defaultdict
+from typing import Deque, Dict, Iterable, Set, Tuple
+from collections import OrderedDict, defaultdict, deque
+import asyncio
+import json
+import re
+import time
+import weakref
 
 from fastapi import WebSocket
-from starlette.websockets import WebSocketDisconnect
 
+from config import settings
+import metrics
+import tracing
+
+# Close code sent to consumers that cannot keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code for connections refused because the tenant is at its cap
+TOO_MANY_CONNECTIONS_CLOSE_CODE = 1013
+# Close code for connections that stopped answering heartbeats
+IDLE_CLOSE_CODE = 1001
+
+# Events relayed from event_bus start with the seq assigned at publish time
+_PUBLISHED_SEQ = re.compile(r'^\{"seq":\s*(\d+)\s*[,}]')
+
+ws_events = metrics.counter(
+    "ws_events_total", "Events fanned out to local websocket connections"
+)
+ws_messages_sent = metrics.counter(
+    "ws_messages_sent_total", "Messages written to websocket connections"
+)
+ws_messages_dropped = metrics.counter(
+    "ws_messages_dropped_total",
+    "Queued messages discarded for slow consumers (overflow=drop)",
+)
+ws_slow_disconnects = metrics.counter(
+    "ws_slow_consumer_disconnects_total",
+    "Connections closed because their send queue was full",
+)
+
+
+def _as_set(value) -> Set:
+    if value is None:
+        return set()
+    if isinstance(value, (list, tuple, set)):
+        return set(value)
+    return {value}
+
+
+class Subscription:
+    """Server-side filter sent by a client in a ``subscribe`` message.
+
+    An event matches when its type is in ``events`` (if given) and, when any
+    of items/departments/categories are given, it concerns one of them.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[str] | None = None,
+        departments: Iterable[int] | None = None,
+        categories: Iterable[int] | None = None,
+        events: Iterable[str] | None = None,
+    ) -> None:
+        self.items = _as_set(items)
+        self.departments = _as_set(departments)
+        self.categories = _as_set(categories)
+        self.events = _as_set(events)
+
+    @classmethod
+    def from_message(cls, message: dict) -> "Subscription":
+        return cls(
+            items=message.get("items"),
+            departments=message.get("department_id"),
+            categories=message.get("category_id"),
+            events=message.get("events"),
+        )
+
+    @property
+    def keyed(self) -> bool:
+        return bool(self.items or self.departments or self.categories)
+
+    def accepts_event(self, event: str | None) -> bool:
+        return not self.events or event in self.events
+
+
+class _Connection:
+    """A websocket with its own bounded send queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, tenant_id: int, max_queue: int) -> None:
+        self.websocket = websocket
+        self.tenant_id = tenant_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue)
+        self.writer: asyncio.Task | None = None
+        self.dropped = 0
+        self.queued_bytes = 0
+        self.last_seen = time.monotonic()
+        self.subscription: Subscription | None = None
+
+
+class _TenantIndex:
+    """Connections of one tenant indexed by the keys they subscribed to."""
 
-class InventoryWSManager:
     def __init__(self) -> None:
-        self.connections: Dict[int, Set[WebSocket]] = defaultdict(set)
+        # Unkeyed subscriptions by event type; None means every event
+        self.wildcard: Dict[str | None, Set[_Connection]] = defaultdict(set)
+        self.by_item: Dict[str, Set[_Connection]] = defaultdict(set)
+        self.by_department: Dict[int, Set[_Connection]] = defaultdict(set)
+        self.by_category: Dict[int, Set[_Connection]] = defaultdict(set)
+        self.filtered = 0
+
+    def _slots(self, conn: _Connection):
+        sub = conn.subscription
+        if sub is None:
+            return [self.wildcard[None]]
+        if not sub.keyed:
+            return [self.wildcard[e] for e in sub.events] or [self.wildcard[None]]
+        return (
+            [self.by_item[k] for k in sub.items]
+            + [self.by_department[k] for k in sub.departments]
+            + [self.by_category[k] for k in sub.categories]
+        )
+
+    def add(self, conn: _Connection) -> None:
+        for slot in self._slots(conn):
+            slot.add(conn)
+        if conn.subscription is not None:
+            self.filtered += 1
+
+    def remove(self, conn: _Connection) -> None:
+        for slot in self._slots(conn):
+            slot.discard(conn)
+        if conn.subscription is not None:
+            self.filtered -= 1
+
+    def targets(self, text: str) -> Iterable[_Connection]:
+        if not self.filtered:
+            return list(self.wildcard[None])
+        data = json.loads(text)
+        event = data.get("event")
+        keyed: Set[_Connection] = set()
+        for index, key in (
+            (self.by_item, data.get("item")),
+            (self.by_department, data.get("department_id")),
+            (self.by_category, data.get("category_id")),
+        ):
+            if key is not None and key in index:
+                keyed |= index[key]
+        targets = {c for c in keyed if c.subscription.accepts_event(event)}
+        targets |= self.wildcard[None]
+        if event in self.wildcard:
+            targets |= self.wildcard[event]
+        return targets
+
+
+class InventoryWSManager:
+    """Fan out tenant events to connected websockets.
+
+    ``broadcast`` serializes each event once and only enqueues it; every
+    connection is drained by its own writer task so a slow client never
+    delays the others. When a connection's queue is full it is either
+    disconnected (``overflow="disconnect"``) or loses its oldest queued
+    message (``overflow="drop"``).
+
+    Every event carries a per-tenant ``seq`` and is kept in a bounded ring
+    buffer so a reconnecting client can ask for what it missed. Events from
+    ``event_bus`` already carry the ``seq`` assigned at publish time, which
+    is the same on every worker; ``broadcast`` without the bus numbers events
+    locally (single process only). A worker only replays when its buffer
+    holds an unbroken run of sequence numbers covering the gap; otherwise
+    it sends ``resync_required``. Buffers only exist for tenants with local
+    sockets; after the last one leaves the buffer is kept for ``replay_ttl``
+    seconds, and at most ``replay_max_tenants`` such idle buffers are kept
+    (least recently used are dropped first).
+
+    Clients may narrow what they receive with a ``subscribe`` message;
+    connections are indexed by the subscribed keys so a broadcast only
+    touches interested sockets.
 
-    async def connect(self, websocket: WebSocket, tenant_id: int) -> None:
+    A background task pings every connection each ``heartbeat_interval``
+    seconds and closes those that have not sent anything (such as a
+    ``pong``) for ``heartbeat_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        max_queue: int | None = None,
+        overflow: str | None = None,
+        replay_size: int | None = None,
+        max_per_tenant: int | None = None,
+        heartbeat_interval: float | None = None,
+        heartbeat_timeout: float | None = None,
+        replay_ttl: float | None = None,
+        replay_max_tenants: int | None = None,
+    ) -> None:
+        self.connections: Dict[int, Dict[WebSocket, _Connection]] = defaultdict(dict)
+        self.max_queue = max_queue or settings.ws_send_queue_size
+        self.overflow = overflow or settings.ws_overflow_policy
+        self.replay_size = replay_size or settings.ws_replay_buffer_size
+        self.replay_ttl = settings.ws_replay_ttl if replay_ttl is None else replay_ttl
+        self.replay_max_tenants = (
+            settings.ws_replay_max_tenants
+            if replay_max_tenants is None
+            else replay_max_tenants
+        )
+        self._seq: Dict[int, int] = {}
+        # Least recently used first
+        self._history: "OrderedDict[int, Deque[Tuple[int, str]]]" = OrderedDict()
+        # When tenants without local sockets lost their last one
+        self._idle_since: Dict[int, float] = {}
+        self._index: Dict[int, _TenantIndex] = defaultdict(_TenantIndex)
+        self.max_per_tenant = max_per_tenant or settings.ws_max_connections_per_tenant
+        self.heartbeat_interval = heartbeat_interval or settings.ws_heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout or settings.ws_heartbeat_timeout
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._heartbeat: asyncio.Task | None = None
+        _managers.add(self)
+
+    async def connect(
+        self, websocket: WebSocket, tenant_id: int, since: int | None = None
+    ) -> bool:
+        """Register a socket, replaying events after ``since`` when given.
+
+        Returns ``False`` (after closing the socket) when the tenant already
+        has ``max_per_tenant`` connections.
+        """
+        if len(self.connections.get(tenant_id, ())) >= self.max_per_tenant:
+            await self._close(websocket, TOO_MANY_CONNECTIONS_CLOSE_CODE)
+            return False
         await websocket.accept()
-        self.connections[tenant_id].add(websocket)
+        self._loop = asyncio.get_running_loop()
+        self._ensure_heartbeat()
+        conn = _Connection(websocket, tenant_id, self.max_queue)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self.connections[tenant_id][websocket] = conn
+        self._index[tenant_id].add(conn)
+        self._idle_since.pop(tenant_id, None)
+        if tenant_id not in self._history:
+            self._history[tenant_id] = deque(maxlen=self.replay_size)
+        if since is not None:
+            self._replay(conn, since)
+        return True
+
+    def stats(self) -> Dict[str, Dict[int, int]]:
+        """Live connections and bytes waiting in send queues, per tenant."""
+        return {
+            "connections": {t: len(c) for t, c in self.connections.items()},
+            "queued_bytes": {
+                t: sum(conn.queued_bytes for conn in c.values())
+                for t, c in self.connections.items()
+            },
+        }
+
+    def _ensure_heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        task = self._heartbeat
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return
+        self._heartbeat = loop.create_task(self._heartbeat_loop())
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.reap_idle()
+
+    def reap_idle(self, now: float | None = None) -> int:
+        """Close connections silent for longer than the timeout, ping the rest."""
+        now = time.monotonic() if now is None else now
+        reaped = 0
+        for conns in list(self.connections.values()):
+            for conn in list(conns.values()):
+                if now - conn.last_seen > self.heartbeat_timeout:
+                    self.disconnect(conn.websocket, conn.tenant_id)
+                    asyncio.ensure_future(self._close(conn.websocket, IDLE_CLOSE_CODE))
+                    reaped += 1
+                else:
+                    self._send(conn, {"event": "ping"})
+        self.prune_history(now)
+        return reaped
+
+    def prune_history(self, now: float | None = None) -> None:
+        """Drop replay buffers of tenants idle past the TTL or over the cap."""
+        now = time.monotonic() if now is None else now
+        for tenant_id, since in list(self._idle_since.items()):
+            if now - since > self.replay_ttl:
+                self._forget(tenant_id)
+        excess = len(self._idle_since) - self.replay_max_tenants
+        if excess > 0:
+            idle = [t for t in self._history if t in self._idle_since]
+            for tenant_id in idle[:excess]:
+                self._forget(tenant_id)
+
+    def _forget(self, tenant_id: int) -> None:
+        self._history.pop(tenant_id, None)
+        self._seq.pop(tenant_id, None)
+        self._idle_since.pop(tenant_id, None)
+
+    def _replay(self, conn: _Connection, since: int) -> None:
+        current = self._seq.get(conn.tenant_id, 0)
+        history = self._history.get(conn.tenant_id)
+        oldest = history[0][0] if history else current + 1
+        newest = history[-1][0] if history else current
+        if since > current or since < oldest - 1 or newest != current:
+            # Restarted worker, the gap fell out of the buffer, or this
+            # worker missed published events and cannot prove continuity
+            self._send(conn, {"event": "resync_required", "seq": current})
+            return
+        for seq, text in history or ():
+            if seq > since:
+                self._enqueue(conn, text)
 
     def disconnect(self, websocket: WebSocket, tenant_id: int) -> None:
-        self.connections[tenant_id].discard(websocket)
-        if not self.connections[tenant_id]:
+        conns = self.connections.get(tenant_id)
+        if conns is None:
+            return
+        conn = conns.pop(websocket, None)
+        if conn is not None:
+            self._index[tenant_id].remove(conn)
+        if not conns:
             self.connections.pop(tenant_id, None)
+            self._index.pop(tenant_id, None)
+            if tenant_id in self._history:
+                self._idle_since[tenant_id] = time.monotonic()
+                self.prune_history()
+        if conn and conn.writer:
+            try:
+                current = asyncio.current_task()
+            except RuntimeError:
+                current = None
+            if conn.writer is not current:
+                conn.writer.cancel()
+
+    async def shutdown(self) -> None:
+        """Stop every writer task and forget all connections."""
+        writers = [
+            conn.writer
+            for conns in self.connections.values()
+            for conn in conns.values()
+            if conn.writer
+        ]
+        self.connections.clear()
+        self._index.clear()
+        heartbeat, self._heartbeat = self._heartbeat, None
+        if heartbeat is not None and heartbeat.get_loop() is asyncio.get_running_loop():
+            writers.append(heartbeat)
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+
+    def subscribe(
+        self,
+        websocket: WebSocket,
+        tenant_id: int,
+        subscription: Subscription | None,
+    ) -> None:
+        """Replace a connection's filter; ``None`` receives everything."""
+        conn = self.connections.get(tenant_id, {}).get(websocket)
+        if conn is None:
+            return
+        if subscription is not None and not (subscription.keyed or subscription.events):
+            subscription = None
+        index = self._index[tenant_id]
+        index.remove(conn)
+        conn.subscription = subscription
+        index.add(conn)
+
+    def handle_message(self, websocket: WebSocket, tenant_id: int, text: str) -> None:
+        """Apply a client control message such as ``subscribe``."""
+        conn = self.connections.get(tenant_id, {}).get(websocket)
+        if conn is None:
+            return
+        conn.last_seen = time.monotonic()
+        try:
+            message = json.loads(text)
+            action = message.get("action")
+        except (ValueError, AttributeError):
+            self._send(conn, {"event": "error", "detail": "Invalid message"})
+            return
+        if action == "subscribe":
+            self.subscribe(websocket, tenant_id, Subscription.from_message(message))
+            self._send(conn, {"event": "subscribed"})
+        elif action == "unsubscribe":
+            self.subscribe(websocket, tenant_id, None)
+            self._send(conn, {"event": "unsubscribed"})
+        elif action == "pong":
+            pass
+        else:
+            self._send(conn, {"event": "error", "detail": "Unknown action"})
+
+    def _send(self, conn: _Connection, data: dict) -> None:
+        self._enqueue(conn, json.dumps(data, separators=(",", ":")))
 
     async def broadcast(self, tenant_id: int, data: dict) -> None:
-        for ws in list(self.connections.get(tenant_id, [])):
+        with tracing.span("ws.broadcast", tenant_id=tenant_id):
+            text = json.dumps(data, separators=(",", ":"))
+            self.broadcast_text(tenant_id, text)
+
+    def broadcast_text(self, tenant_id: int, text: str) -> None:
+        """Queue an already serialized event; safe to call from any thread."""
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is not None and running is not loop and not loop.is_closed():
+            # Queues belong to the loop serving the sockets
+            loop.call_soon_threadsafe(self._fanout, tenant_id, text)
+            return
+        self._fanout(tenant_id, text)
+
+    def _stamp(self, tenant_id: int, text: str) -> str:
+        last = self._seq.get(tenant_id)
+        history = self._history[tenant_id]
+        self._history.move_to_end(tenant_id)
+        match = _PUBLISHED_SEQ.match(text)
+        if match is not None:
+            seq = int(match.group(1))
+            stamped = text
+            if last is not None and seq != last + 1:
+                # Missed or reordered events: older entries no longer form
+                # an unbroken run with this one
+                history.clear()
+            self._seq[tenant_id] = max(seq, last or 0)
+        else:
+            seq = self._seq[tenant_id] = (last or 0) + 1
+            body = text.strip()[1:]
+            sep = "" if body.lstrip().startswith("}") else ","
+            stamped = f'{{"seq":{seq}{sep}{body}'
+        history.append((seq, stamped))
+        return stamped
+
+    def _fanout(self, tenant_id: int, text: str) -> None:
+        # Relayed events arrive without a request, so this may start a trace
+        with tracing.span("ws.fanout", root=True, tenant_id=tenant_id) as span:
+            ws_events.inc()
+            if tenant_id not in self._history:
+                # No local sockets now or recently: nothing to send or replay
+                return
+            text = self._stamp(tenant_id, text)
+            index = self._index.get(tenant_id)
+            if index is None:
+                return
+            recipients = 0
+            for conn in list(index.targets(text)):
+                self._enqueue(conn, text)
+                recipients += 1
+            if span is not None:
+                span.set_attribute("ws.recipients", recipients)
+
+    def _enqueue(self, conn: _Connection, text: str) -> None:
+        try:
+            conn.queue.put_nowait(text)
+            conn.queued_bytes += len(text)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.overflow == "drop":
+            conn.queued_bytes -= len(conn.queue.get_nowait())
+            conn.queue.put_nowait(text)
+            conn.queued_bytes += len(text)
+            conn.dropped += 1
+            ws_messages_dropped.inc()
+            return
+        ws_slow_disconnects.inc()
+        self.disconnect(conn.websocket, conn.tenant_id)
+        asyncio.ensure_future(self._close(conn.websocket, SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _writer(self, conn: _Connection) -> None:
+        while True:
+            text = await conn.queue.get()
+            conn.queued_bytes -= len(text)
             try:
-                await ws.send_json(data)
-            except WebSocketDisconnect:
-                self.disconnect(ws, tenant_id)
+                await conn.websocket.send_text(text)
+                ws_messages_sent.inc()
             except Exception:
-                self.disconnect(ws, tenant_id)
+                self.disconnect(conn.websocket, conn.tenant_id)
+                return
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int) -> None:
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+
+_managers: "weakref.WeakSet[InventoryWSManager]" = weakref.WeakSet()
+
+
+def _sum_stats(key: str) -> float:
+    # Totals only: a per-tenant label would grow with the number of tenants
+    return sum(sum(m.stats()[key].values()) for m in list(_managers))
+
+
+metrics.gauge(
+    "ws_connections",
+    "Live websocket connections",
+    callback=lambda: _sum_stats("connections"),
+)
+metrics.gauge(
+    "ws_queued_bytes",
+    "Bytes waiting in websocket send queues",
+    callback=lambda: _sum_stats("queued_bytes"),
+)